@@ -0,0 +1,217 @@
+# This script is used to measure the throughput of the stages of the green view index calculation on synthetic
+# data, so the numbers do not depend on the network. Run it from the Treepedia folder: python Benchmark.py
+
+import os
+import subprocess
+import sys
+import time
+from io import BytesIO
+
+import numpy
+from PIL import Image
+
+
+def synthetic_jpegs(num=50, size=400, seed=0):
+    """
+    Create JPEG images similar to the GSV images, smooth colour gradients with noise
+
+    Return:
+        list of the bytes of the JPEG images
+    """
+
+    rng = numpy.random.default_rng(seed)
+    ramp = numpy.linspace(0, 1, size)
+
+    contents = []
+    for i in range(num):
+        colour = rng.uniform(0, 255, (2, 3))
+        weights = numpy.add.outer(ramp, ramp)[:, :, None] / 2.0
+        img = colour[0] * (1 - weights) + colour[1] * weights + rng.normal(0, 20, (size, size, 3))
+        img = numpy.clip(img, 0, 255).astype(numpy.uint8)
+
+        buffer = BytesIO()
+        Image.fromarray(img).save(buffer, 'JPEG', quality=85)
+        contents.append(buffer.getvalue())
+
+    return contents
+
+
+def benchmark_decode(contents, working_size=None, preallocated=False, repeat=3):
+    """
+    Measure the JPEG decode throughput of decode_image in one process
+
+    Return:
+        the number of decoded images per second per core (the best of the repeats)
+    """
+
+    if __package__:
+        from .GreenView_Calculate import decode_image
+    else:
+        from GreenView_Calculate import decode_image
+
+    out = None
+    if preallocated:
+        size = working_size
+        if size is None:
+            size = Image.open(BytesIO(contents[0])).size[0]
+        out = numpy.empty((size, size, 3), dtype=numpy.uint8)
+
+    best = 0.0
+    for r in range(repeat):
+        start = time.perf_counter()
+        for content in contents:
+            decode_image(content, working_size, out)
+        best = max(best, len(contents) / (time.perf_counter() - start))
+
+    return best
+
+
+def benchmark_decode_baseline(contents, repeat=3):
+    """
+    Measure the throughput of the original decode, numpy.array(Image.open(BytesIO(response.content)))
+    """
+
+    best = 0.0
+    for r in range(repeat):
+        start = time.perf_counter()
+        for content in contents:
+            numpy.array(Image.open(BytesIO(content)))
+        best = max(best, len(contents) / (time.perf_counter() - start))
+
+    return best
+
+
+# the imports of the entry point of every stage, including the modules the stage function imports when it runs,
+# the classification stage is what every worker process of the classification pool imports
+STAGE_IMPORTS = {
+    'package': 'import Treepedia',
+    'createPoints': 'import createPoints, fiona, shapely.geometry, shapely.ops, pyproj',
+    'metadataCollector': 'import metadataCollector, xmltodict, ogr, pyproj, GSVProvider, KeyPool',
+    'GreenView_Calculate': 'import GreenView_Calculate, GSVProvider, KeyPool',
+    'classification worker': 'import GreenView_Calculate, Segmentor',
+    'Greenview2Shp': 'import Greenview2Shp, ogr',
+    'CorridorInteruption': 'import CorridorInteruption, fiona, shapely, pyproj',
+}
+
+
+def benchmark_startup(stage_imports=None, repeat=5):
+    """
+    Measure the startup time of a new python process importing the entry point of each stage, which is paid by
+    every spawned worker process. The time of an empty python process is subtracted
+
+    Return:
+        dictionary of the stage and the best startup time in seconds, None if the imports fail (e.g. a missing
+        dependency)
+
+    Parameters:
+        stage_imports: dictionary of the stage and its import statement, the default is STAGE_IMPORTS
+        repeat: the number of processes started for every stage
+    """
+
+    if stage_imports is None:
+        stage_imports = STAGE_IMPORTS
+
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([os.path.dirname(os.path.abspath(__file__)), package_root])
+
+    def best_time(statement):
+        best = None
+        for r in range(repeat):
+            start = time.perf_counter()
+            result = subprocess.run([sys.executable, '-c', statement], env=env, stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.DEVNULL)
+            elapsed = time.perf_counter() - start
+            if result.returncode != 0:
+                return None
+            if best is None or elapsed < best:
+                best = elapsed
+        return best
+
+    empty = best_time('pass')
+
+    startup = {}
+    for stage, statement in stage_imports.items():
+        elapsed = best_time(statement)
+        startup[stage] = None if elapsed is None else elapsed - empty
+
+    return startup
+
+
+def benchmark_handoff(contents, workers=2, shared_memory_slots=None, repeat=3):
+    """
+    Measure the hand-off of the decoded images from the download threads to the worker processes, the workers
+    only compute the mean of the image, so the time is the decode and the transfer. The images are either pickled
+    to the workers or decoded into the shared memory slots of an ImageRing
+
+    Return:
+        the number of the images per second (the best of the repeats)
+    """
+
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+    if __package__:
+        from .GreenView_Calculate import decode_image
+        from . import ImageRing
+    else:
+        from GreenView_Calculate import decode_image
+        import ImageRing
+
+    size = Image.open(BytesIO(contents[0])).size[0]
+    best = 0.0
+
+    with ThreadPoolExecutor(workers * 2) as threads, ProcessPoolExecutor(workers) as processes:
+        ring = None
+        if shared_memory_slots is not None:
+            ring = ImageRing.ImageRing(shared_memory_slots, size)
+
+        def pickled(content):
+            return processes.submit(numpy.mean, decode_image(content)).result()
+
+        def shared(content):
+            index = ring.acquire()
+            try:
+                decode_image(content, None, ring.slot(index))
+                return processes.submit(ImageRing.run_on_slot, numpy.mean, ring.shm.name, ring.slot_shape,
+                                        index).result()
+            finally:
+                ring.release(index)
+
+        # start the workers before the measurement
+        list(processes.map(abs, range(workers)))
+
+        for r in range(repeat):
+            start = time.perf_counter()
+            list(threads.map(pickled if ring is None else shared, contents))
+            best = max(best, len(contents) / (time.perf_counter() - start))
+
+        if ring is not None:
+            ring.close()
+
+    return best
+
+
+# ------------------------------Main function-------------------------------
+if __name__ == "__main__":
+    jpegs = synthetic_jpegs()
+
+    print('JPEG decode, images/s per core')
+    print('%-45s %10.1f' % ('numpy.array(Image.open(...))', benchmark_decode_baseline(jpegs)))
+    print('%-45s %10.1f' % ('decode_image', benchmark_decode(jpegs)))
+    print('%-45s %10.1f' % ('decode_image, preallocated', benchmark_decode(jpegs, preallocated=True)))
+    for size in [200, 100]:
+        print('%-45s %10.1f' % ('decode_image, working size %d' % size, benchmark_decode(jpegs, size)))
+        print('%-45s %10.1f' % ('decode_image, working size %d, preallocated' % size,
+                                benchmark_decode(jpegs, size, preallocated=True)))
+
+    print('Image hand-off to 2 worker processes, images/s')
+    big_jpegs = synthetic_jpegs(100, 640)
+    print('%-45s %10.1f' % ('pickled arrays', benchmark_handoff(big_jpegs)))
+    print('%-45s %10.1f' % ('shared memory ring, 4 slots', benchmark_handoff(big_jpegs, shared_memory_slots=4)))
+
+    print('Startup time of the stage entry points, ms')
+    for stage, elapsed in benchmark_startup().items():
+        if elapsed is None:
+            print('%-45s %10s' % (stage, 'failed'))
+        else:
+            print('%-45s %10.1f' % (stage, elapsed * 1000))
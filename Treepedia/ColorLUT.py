@@ -0,0 +1,188 @@
+# This script is used to classify the green vegetation pixels with a lookup table. Except the Otsu threshold, the
+# pixel rules of GreenView_Calculate.vegetation_classification (the ExG, the green - red and green - blue
+# differences, and the bright and shadow thresholds) only depend on the colour of the pixel, so they are computed once
+# for the quantized colours. A segmented image is then packed into one colour code per pixel, the Otsu threshold is
+# computed from the histogram of the codes, and the pixels are classified with one index of the table by the codes.
+
+import collections
+
+import numpy
+
+# the rules of a colour table, for the colour codes of bits per channel:
+#   exg: the ExG of the colour, exg_bin: the bin of the ExG in the histogram of graythresh
+#   bright: the colour is under the bright thresholds, shadow: the colour is a green shadow
+ColorTable = collections.namedtuple('ColorTable', ['bits', 'exg', 'exg_bin', 'bright', 'shadow'])
+
+_color_tables = {}
+
+
+def build_color_table(bits=6):
+    """
+    Compute the pixel rules of vegetation_classification for all colours quantized to bits per channel, at the
+    centre of the quantization bins
+
+    Return:
+        the ColorTable, indexed by the colour codes of pixel_codes
+    """
+
+    levels = 2 ** bits
+    values = (numpy.arange(levels) + 0.5) * (256.0 / levels) / 255.0
+
+    red = values[:, None, None]
+    green = values[None, :, None]
+    blue = values[None, None, :]
+
+    green_red_diff = green - red
+    green_blue_diff = green - blue
+    exg = (green_red_diff + green_blue_diff).ravel()
+
+    bright = ((red < 0.6) & (green < 0.9) & (blue < 0.6)).ravel()
+    shadow = ((red < 0.3) & (green < 0.3) & (blue < 0.3)).ravel() & (exg > 0.05)
+
+    # the bins of the ExG histogram of graythresh, the negative values are counted as 0
+    exg_bin = numpy.clip(numpy.floor(exg * 255), 0, 255).astype(numpy.int64)
+
+    return ColorTable(bits, exg, exg_bin, bright, shadow)
+
+
+def color_table(bits=6):
+    """
+    The ColorTable of bits per channel, built once per process
+    """
+
+    if bits not in _color_tables:
+        _color_tables[bits] = build_color_table(bits)
+
+    return _color_tables[bits]
+
+
+def pixel_codes(img, bits=6):
+    """
+    Pack the colour of every pixel of the RGB image into one code, the top bits of the red, green and blue channels
+    """
+
+    quantized = numpy.clip(img, 0, 255).astype(numpy.uint32) >> (8 - bits)
+
+    return (quantized[:, :, 0] << (2 * bits)) | (quantized[:, :, 1] << bits) | quantized[:, :, 2]
+
+
+def classify_segmented(segmented_image, bits=6, return_mask=False):
+    """
+    Classify the green vegetation pixels of the segmented image with the ColorTable, see
+    lut_vegetation_classification
+    """
+
+    if __package__:
+        from .GreenView_Calculate import otsu_threshold
+    else:
+        from GreenView_Calculate import otsu_threshold
+
+    table = color_table(bits)
+    codes = pixel_codes(segmented_image, bits)
+    code_hist = numpy.bincount(codes.ravel(), minlength=len(table.exg))
+    used = numpy.flatnonzero(code_hist)
+
+    # the histogram of the ExG for the Otsu threshold, graythresh does not scale the ExG if it is above 1
+    if table.exg[used].max() <= 1:
+        exg_bins = table.exg_bin[used]
+    else:
+        exg_bins = numpy.clip(numpy.floor(table.exg[used]), 0, 255).astype(numpy.int64)
+    threshold = otsu_threshold(numpy.bincount(exg_bins, weights=code_hist[used], minlength=256), 0.1)
+
+    if threshold > 0.1:
+        threshold = 0.1
+    elif threshold < 0.05:
+        threshold = 0.05
+
+    green_table = (table.bright & (table.exg > threshold)) | table.shadow
+    green_percent = code_hist[green_table].sum() / float(codes.size) * 100
+
+    if return_mask:
+        return green_percent, green_table[codes]
+
+    return green_percent
+
+
+def lut_vegetation_classification(img, bits=6, return_mask=False):
+    """
+    Classify the green vegetation from the GSV image like GreenView_Calculate.vegetation_classification, with the
+    pixel rules from the ColorTable of the colours quantized to bits per channel
+
+    Parameters:
+        img: the numpy array image
+        bits: the bits per colour channel of the table, 6 bits give a table of 262144 colours
+        return_mask: also return the boolean mask of the green vegetation pixels
+    """
+
+    if __package__:
+        from . import Segmentor
+    else:
+        import Segmentor
+
+    return classify_segmented(Segmentor.segment(img), bits, return_mask)
+
+
+def compare_with_exact(images, bits_list=(5, 6, 7), repeat=3):
+    """
+    Measure the accuracy and the speed of the pixel rules of the table against the exact pixel rules of
+    vegetation_classification, on the same segmented images
+
+    Return:
+        list of the (bits, mean absolute error of the green percent, max absolute error, share of the pixels
+        classified differently, ms per image of the table, ms per image of the exact rules)
+    """
+
+    import time
+
+    if __package__:
+        from . import Segmentor
+        from .GreenView_Calculate import pixel_classification
+    else:
+        import Segmentor
+        from GreenView_Calculate import pixel_classification
+
+    segmented_images = [Segmentor.segment(img) for img in images]
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        exact = [pixel_classification(segmented, return_mask=True) for segmented in segmented_images]
+    exact_ms = (time.perf_counter() - start) * 1000.0 / repeat / len(images)
+
+    report = []
+    for bits in bits_list:
+        color_table(bits)
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            approx = [classify_segmented(segmented, bits, return_mask=True) for segmented in segmented_images]
+        lut_ms = (time.perf_counter() - start) * 1000.0 / repeat / len(images)
+
+        errors = numpy.array([abs(a[0] - e[0]) for a, e in zip(approx, exact)])
+        differ = numpy.mean([numpy.mean(a[1] != e[1]) for a, e in zip(approx, exact)])
+        report.append((bits, errors.mean(), errors.max(), differ, lut_ms, exact_ms))
+
+    return report
+
+
+# ------------Main Function -------------------
+if __name__ == "__main__":
+    import os
+    import sys
+
+    if __package__:
+        from .GreenView_Calculate import decode_image
+    else:
+        from GreenView_Calculate import decode_image
+
+    # the GSV images in a folder, e.g. a folder of GSVProvider.CachedProvider
+    image_folder = sys.argv[1] if len(sys.argv) > 1 else '..\\kastela\\image_cache'
+    images = []
+    for name in sorted(os.listdir(image_folder))[:50]:
+        if name.endswith('.jpg'):
+            with open(os.path.join(image_folder, name), 'rb') as image_file:
+                images.append(decode_image(image_file.read()))
+
+    print('%-6s %12s %12s %14s %10s %10s' % ('bits', 'mean error', 'max error', 'pixels differ', 'lut ms', 'exact ms'))
+    for bits, mean_error, max_error, differ, lut_ms, exact_ms in compare_with_exact(images):
+        print('%-6d %12.4f %12.4f %13.3f%% %10.2f %10.2f' % (bits, mean_error, max_error, differ * 100, lut_ms,
+                                                             exact_ms))
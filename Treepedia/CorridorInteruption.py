@@ -1,66 +1,217 @@
-def calculate_interuptions(gvi_points, shp_corridors, outshp, dist):
+def read_gvi_points(gvi_points, transformer, chunk_size=100000):
+    """
+    Read the green view index points into compact coordinate arrays, instead of a list of shapely points. The
+    points are read sequentially and projected in chunks with one bulk transform per chunk. The arrays are sorted by
+    the x coordinate, so the points of a bounding box can be found with a binary search
+
+    Return:
+        xs, ys, gvi: numpy arrays of the projected coordinates and the green view index of the points
+
+    Parameters:
+        gvi_points: the point shapefile with the greenView field, in WGS84
+        transformer: the pyproj transformer from WGS84 to the projected coordinates
+        chunk_size: the number of points projected at once
+    """
 
     import fiona
-    from fiona import crs
-    from shapely.geometry import shape, mapping
+    import numpy
+
+    xs_chunks = []
+    ys_chunks = []
+    gvi_chunks = []
+
+    with fiona.open(gvi_points, 'r', encoding='UTF-8') as points:
+        lons = numpy.empty(chunk_size)
+        lats = numpy.empty(chunk_size)
+        gvi = numpy.empty(chunk_size)
+        num = 0
+
+        for point in points:
+            lons[num], lats[num] = point['geometry']['coordinates'][:2]
+            gvi[num] = point['properties']['greenView']
+            num += 1
+
+            if num == chunk_size:
+                xs, ys = transformer.transform(lons, lats)
+                xs_chunks.append(xs)
+                ys_chunks.append(ys)
+                gvi_chunks.append(gvi.copy())
+                num = 0
+
+        if num > 0:
+            xs, ys = transformer.transform(lons[:num], lats[:num])
+            xs_chunks.append(xs)
+            ys_chunks.append(ys)
+            gvi_chunks.append(gvi[:num].copy())
+
+    if len(xs_chunks) == 0:
+        return numpy.empty(0), numpy.empty(0), numpy.empty(0)
+
+    xs = numpy.concatenate(xs_chunks)
+    ys = numpy.concatenate(ys_chunks)
+    gvi = numpy.concatenate(gvi_chunks)
+    del xs_chunks, ys_chunks, gvi_chunks
+
+    order = numpy.argsort(xs, kind='stable')
+    return xs[order], ys[order], gvi[order]
+
+
+def local_utm_crs(bounds):
+    """
+    The CRS of the UTM zone of the centre of the bounds (minx, miny, maxx, maxy in WGS84). Its units are meters on
+    the ground, unlike the Web Mercator (EPSG:3857) whose units are stretched by 1 / cos(latitude), e.g. 1.38 at
+    43.5 degree
+    """
+
+    from pyproj import CRS
+    from pyproj.aoi import AreaOfInterest
+    from pyproj.database import query_utm_crs_info
+
+    lon = (bounds[0] + bounds[2]) / 2.0
+    lat = (bounds[1] + bounds[3]) / 2.0
+    utm_info = query_utm_crs_info(datum_name='WGS 84', area_of_interest=AreaOfInterest(lon, lat, lon, lat))
+
+    return CRS.from_epsg(utm_info[0].code)
+
+
+def corridor_segments(corridor, xs, ys, gvi_arr, dist):
+    """
+    Cut the corridor into segments of dist meters, and compute the mean green view index of the points in the buffer
+    of every segment. The segments are generated one by one, the segments without points are left out
+
+    Return:
+        generator of the (buffer_zone, chainage_start, chainage_end, point_count, gvi) of the segments, the buffer
+        and the chainage in the projected coordinates, the coordinates must be in meters (see local_utm_crs)
+
+    Parameters:
+        corridor: the corridor line in the projected coordinates
+        xs, ys, gvi_arr: the points, sorted by x, see read_gvi_points
+        dist: the length of the segments
+    """
+
+    from shapely import contains_xy
     from shapely.ops import substring
+
+    for min_dist in range(0, int(corridor.length), dist):
+        max_dist = min_dist + dist
+        buffer_zone = substring(corridor, min_dist, max_dist).buffer(30, cap_style=2)
+
+        # only the points in the bounding box of the buffer are tested
+        minx, miny, maxx, maxy = buffer_zone.bounds
+        first, last = xs.searchsorted([minx, maxx])
+        in_box = (ys[first:last] >= miny) & (ys[first:last] <= maxy)
+        box_xs = xs[first:last][in_box]
+        box_ys = ys[first:last][in_box]
+        box_gvi = gvi_arr[first:last][in_box]
+
+        gvi_values = box_gvi[contains_xy(buffer_zone, box_xs, box_ys)]
+
+        if len(gvi_values) == 0:
+            continue
+        yield buffer_zone, float(min_dist), min(float(max_dist), corridor.length), len(gvi_values), \
+            float(gvi_values.mean())
+
+
+def calculate_interuptions(gvi_points, shp_corridors, outshp, dist, report_memory=False, corridor_id_field=None,
+                           batch_size=1000):
+    """
+    Find the interuptions of the greenery along the corridors. Every corridor is cut into segments of dist meters
+    with the mean green view index of the points in a 30 meters buffer, a segment is greening when its green view
+    index is below 70% of the mean of the two previous segments, until it is above 130% of that mean again. The
+    segments are written while the corridors are processed, in transactions of batch_size segments
+
+    The lengths are measured in the UTM zone of the corridors (see local_utm_crs)
+
+    Parameters:
+        gvi_points: the point shapefile with the greenView field, in WGS84
+        shp_corridors: the corridor lines, in WGS84
+        outshp: the output buffers of the segments, a GeoPackage (.gpkg, with a spatial index) or a shapefile, with
+        the fields corridor (the corridor ID), chain_from and chain_to (the chainage of the segment along the
+        corridor in meters), points (the number of the points in the buffer), gvi and greening
+        dist: the length of the segments in meters
+        report_memory: report the memory of the stages, see MemoryUsage.memory_stage
+        corridor_id_field: the field of the corridors with the corridor ID, None to use the feature ID
+        batch_size: the number of the segments written in one transaction
+    """
+
+    import fiona
+    from fiona import crs
+    from shapely.geometry import MultiPolygon, shape, mapping
     from shapely.ops import transform
     from pyproj import Transformer, CRS
-    from statistics import mean
+    if __package__:
+        from .MemoryUsage import memory_stage
+    else:
+        from MemoryUsage import memory_stage
 
-    with fiona.open(gvi_points, 'r', encoding='UTF-8') as points:
-        with fiona.open(shp_corridors, 'r', encoding='UTF-8') as corridors:
-            wgs84 = CRS('EPSG:4326')
-            pseudo_mercator = CRS('EPSG:3857')
-            projection1 = Transformer.from_crs(wgs84, pseudo_mercator, always_xy=True).transform
-            projection2 = Transformer.from_crs(pseudo_mercator, wgs84, always_xy=True).transform
-
-            points_lst = []
-            for point in points:
-                points_lst.append([shape(point['geometry']), point['properties']['greenView']])
-
-            corridors_lst = []
-            for corridor in corridors:
-                corridors_lst.append(transform(projection1, shape(corridor['geometry'])))
-
-            shp_schema = {'geometry': 'Polygon', 'properties': {'gvi': 'float', 'greening': 'int'}}
-            with fiona.open(outshp, 'w', encoding='UTF-8', schema=shp_schema, driver='ESRI Shapefile',
-                            crs=crs.from_epsg(4326)) as corridor_interuptions:
-                for corridor in corridors_lst:
-                    buffer_gvi = []
-                    min_dist = 0
-
-                    for max_dist in range(dist, int(corridor.length)+dist, dist):
-                        buffer_zone = transform(
-                            projection2, substring(corridor, min_dist, max_dist).buffer(30, cap_style=2))
-
-                        gvi_values = []
-                        for point, gvi in points_lst:
-                            if point.within(buffer_zone):
-                                gvi_values.append(gvi)
-
-                        if len(gvi_values) == 0:
-                            min_dist += dist
-                            continue
-                        buffer_gvi.append([buffer_zone, mean(gvi_values)])
-                        min_dist += dist
-
-                    gvi_lst = []
-                    greening = 0
-                    for idx, (buffer, gvi) in enumerate(buffer_gvi):
-                        new_buffer = {}
-                        gvi_lst.append(gvi)
-                        new_buffer['geometry'] = mapping(buffer)
-                        if idx < 2:
-                            new_buffer['properties'] = {'gvi': gvi, 'greening': greening}
-                            corridor_interuptions.write(new_buffer)
-                        else:
-                            if gvi < 0.7 * mean(gvi_lst[idx-2:idx]):
-                                greening = 1
-                            elif gvi > 1.3 * mean(gvi_lst[idx-2:idx]):
-                                greening = 0
-                            new_buffer['properties'] = {'gvi': gvi, 'greening': greening}
-                            corridor_interuptions.write(new_buffer)
+    with fiona.open(shp_corridors, 'r', encoding='UTF-8') as corridors:
+        utm = local_utm_crs(corridors.bounds)
+
+    wgs84 = CRS('EPSG:4326')
+    transformer = Transformer.from_crs(wgs84, utm, always_xy=True)
+    projection1 = transformer.transform
+    projection2 = Transformer.from_crs(utm, wgs84, always_xy=True).transform
+
+    with memory_stage('read gvi points', report_memory):
+        xs, ys, gvi_arr = read_gvi_points(gvi_points, transformer)
+
+    if outshp.lower().endswith('.gpkg'):
+        driver_options = {'driver': 'GPKG', 'SPATIAL_INDEX': 'YES'}
+    else:
+        driver_options = {'driver': 'ESRI Shapefile'}
+
+    # the buffer of a bent segment can be a multipolygon, the GeoPackage layer needs one geometry type
+    shp_schema = {'geometry': 'MultiPolygon',
+                  'properties': {'corridor': 'str', 'chain_from': 'float', 'chain_to': 'float', 'points': 'int',
+                                 'gvi': 'float', 'greening': 'int'}}
+    num_segments = 0
+
+    with memory_stage('corridor interuptions', report_memory), \
+            fiona.open(shp_corridors, 'r', encoding='UTF-8') as corridors, \
+            fiona.open(outshp, 'w', encoding='UTF-8', schema=shp_schema, crs=crs.from_epsg(4326),
+                       **driver_options) as corridor_interuptions:
+        batch = []
+
+        # the corridors are read one by one, and the points are tested in the projected coordinates
+        for corridor_feature in corridors:
+            if corridor_id_field is None:
+                corridor_id = str(corridor_feature['id'])
+            else:
+                corridor_id = str(corridor_feature['properties'][corridor_id_field])
+
+            corridor = transform(projection1, shape(corridor_feature['geometry']))
+            prev_gvi = []
+            greening = 0
+
+            for buffer_zone, chain_from, chain_to, points, gvi in corridor_segments(corridor, xs, ys, gvi_arr, dist):
+                # the greening of the first two segments is not known, it is the greening of the corridor start
+                if len(prev_gvi) == 2:
+                    prev_mean = (prev_gvi[0] + prev_gvi[1]) / 2.0
+                    if gvi < 0.7 * prev_mean:
+                        greening = 1
+                    elif gvi > 1.3 * prev_mean:
+                        greening = 0
+                prev_gvi = prev_gvi[-1:] + [gvi]
+
+                buffer_zone = transform(projection2, buffer_zone)
+                if buffer_zone.geom_type == 'Polygon':
+                    buffer_zone = MultiPolygon([buffer_zone])
+
+                batch.append({'geometry': mapping(buffer_zone),
+                              'properties': {'corridor': corridor_id, 'chain_from': chain_from, 'chain_to': chain_to,
+                                             'points': points, 'gvi': gvi, 'greening': greening}})
+
+                if len(batch) >= batch_size:
+                    corridor_interuptions.writerecords(batch)
+                    num_segments += len(batch)
+                    batch = []
+
+        if len(batch) > 0:
+            corridor_interuptions.writerecords(batch)
+            num_segments += len(batch)
+
+    print('Wrote %d corridor segments to %s' % (num_segments, outshp))
+    return num_segments
 
 
 if __name__ == "__main__":
@@ -70,5 +221,5 @@ if __name__ == "__main__":
     root = '..\\kastela'
     inshp_gvi_points = os.path.join(root, 'GVI_points_clean.shp')
     inshp_corridors = os.path.join(root, 'main_streets.shp')
-    outshp = os.path.join(root, 'corridor_interuptions.shp')
-    calculate_interuptions(inshp_gvi_points, inshp_corridors, outshp, dist)
+    outshp = os.path.join(root, 'corridor_interuptions.gpkg')
+    calculate_interuptions(inshp_gvi_points, inshp_corridors, outshp, dist, report_memory=True)
@@ -0,0 +1,365 @@
+# This script contains the providers used to request the metadata and the images of the GSV panoramas.
+# GoogleProvider calls the Google API, RecordingProvider saves every response of another provider to a folder,
+# ReplayProvider serves the saved responses without network (with configurable latency and error rate),
+# CachedProvider keeps the downloaded images on disk so each image is only downloaded once and
+# start_replay_server serves the saved responses over HTTP, so that the whole pipeline can be run against a local
+# stand-in of the Street View API.
+
+import collections
+import os
+import random
+import threading
+import time
+
+ProviderResponse = collections.namedtuple('ProviderResponse', ['status', 'content'])
+
+
+def image_record_name(pano_id, heading, pitch, size, fov):
+    """
+    Name of the record for the GSV image request, used by the recording and the replay providers
+    """
+
+    return 'img_%s_%d_%d_%d_%d.jpg' % (pano_id, heading, pitch, size, fov)
+
+
+def tile_record_name(pano_id, zoom, x, y):
+    """
+    Name of the record for the tile of the equirectangular panorama, used by the recording and the replay providers
+    """
+
+    return 'tile_%s_%d_%d_%d.jpg' % (pano_id, zoom, x, y)
+
+
+def metadata_record_name(lat, lon):
+    """
+    Name of the record for the GSV metadata request, used by the recording and the replay providers
+    """
+
+    return 'meta_%s_%s.xml' % (lat, lon)
+
+
+def save_record(record_folder, record_name, response):
+    """
+    Save the response to the record folder, a status file is written next to the content for non 200 responses,
+    and the status file of an earlier response is removed for a 200 response
+    """
+
+    record_file = os.path.join(record_folder, record_name)
+
+    # write to a temporary file first, so a reader never sees a partly written record, the temporary file is unique
+    # for the thread, several runs can share the record folder
+    temp_file = '%s.%d.%d.tmp' % (record_file, os.getpid(), threading.get_ident())
+    with open(temp_file, 'wb') as record:
+        record.write(response.content)
+    os.replace(temp_file, record_file)
+
+    if response.status != 200:
+        with open(record_file + '.status', 'w') as status:
+            status.write('%d' % response.status)
+    else:
+        try:
+            os.remove(record_file + '.status')
+        except FileNotFoundError:
+            pass
+
+
+class GoogleProvider:
+    """
+    Request the GSV metadata and images from the Google API. The image_host and the metadata_host can be changed to
+    the url of the local replay server (see start_replay_server), e.g. 'http://127.0.0.1:8000'
+
+    Parameters:
+        image_host: the host of the Street View Static API
+        metadata_host: the host of the cbk metadata and panorama tile service
+        timeout: timeout of each request in seconds
+    """
+
+    def __init__(self, image_host='http://maps.googleapis.com', metadata_host='http://maps.google.com', timeout=30):
+        import requests
+
+        self.image_host = image_host
+        self.metadata_host = metadata_host
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def _get(self, url):
+        response = self.session.get(url, timeout=self.timeout)
+        return ProviderResponse(response.status_code, response.content)
+
+    def get_image(self, pano_id, heading, pitch=0, size=400, fov=60, key=None):
+        url = "%s/maps/api/streetview?size=%dx%d&pano=%s&fov=%d&heading=%d&pitch=%d&sensor=false" % (
+            self.image_host, size, size, pano_id, fov, heading, pitch)
+        if key is not None:
+            url += '&key=%s' % key
+
+        return self._get(url)
+
+    def get_tile(self, pano_id, zoom, x, y, key=None):
+        url = '%s/cbk?output=tile&panoid=%s&zoom=%d&x=%d&y=%d' % (self.metadata_host, pano_id, zoom, x, y)
+        if key is not None:
+            url += '&key=%s' % key
+
+        return self._get(url)
+
+    def get_metadata(self, lat, lon, key=None):
+        url = '%s/cbk?output=xml&ll=%s,%s' % (self.metadata_host, lat, lon)
+        if key is not None:
+            url += '&key=%s' % key
+
+        return self._get(url)
+
+
+class RecordingProvider:
+    """
+    Forward the requests to another provider and save every response to the record folder, the saved responses
+    can be served later by the ReplayProvider. A status file is written next to the content for non 200 responses.
+
+    Parameters:
+        provider: the provider doing the actual requests, e.g. GoogleProvider()
+        record_folder: the folder for the saved responses
+    """
+
+    def __init__(self, provider, record_folder):
+        self.provider = provider
+        self.record_folder = record_folder
+
+        if not os.path.exists(record_folder):
+            os.makedirs(record_folder)
+
+    def _save(self, record_name, response):
+        save_record(self.record_folder, record_name, response)
+        return response
+
+    def get_image(self, pano_id, heading, pitch=0, size=400, fov=60, key=None):
+        response = self.provider.get_image(pano_id, heading, pitch, size, fov, key=key)
+        return self._save(image_record_name(pano_id, heading, pitch, size, fov), response)
+
+    def get_tile(self, pano_id, zoom, x, y, key=None):
+        response = self.provider.get_tile(pano_id, zoom, x, y, key=key)
+        return self._save(tile_record_name(pano_id, zoom, x, y), response)
+
+    def get_metadata(self, lat, lon, key=None):
+        response = self.provider.get_metadata(lat, lon, key=key)
+        return self._save(metadata_record_name(lat, lon), response)
+
+
+class ReplayProvider:
+    """
+    Serve the responses saved by the RecordingProvider without network. Requests which were not recorded get a
+    404 response.
+
+    Parameters:
+        record_folder: the folder with the saved responses
+        latency: the delay of every response in seconds, a number or a (min, max) tuple for uniform random delay
+        error_rate: the share of the requests (0 - 1) answered with one of the error_statuses
+        error_statuses: the statuses used for the simulated errors
+        seed: the seed of the random generator, to make the simulated errors reproducible
+    """
+
+    def __init__(self, record_folder, latency=0.0, error_rate=0.0, error_statuses=(500, 503), seed=None):
+        self.record_folder = record_folder
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_statuses = error_statuses
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def _load(self, record_name):
+        with self.lock:
+            if isinstance(self.latency, tuple):
+                delay = self.random.uniform(*self.latency)
+            else:
+                delay = self.latency
+            is_error = self.random.random() < self.error_rate
+            error_status = self.random.choice(self.error_statuses)
+
+        if delay > 0:
+            time.sleep(delay)
+
+        if is_error:
+            return ProviderResponse(error_status, b'')
+
+        record_file = os.path.join(self.record_folder, record_name)
+        if not os.path.exists(record_file):
+            return ProviderResponse(404, b'')
+
+        with open(record_file, 'rb') as record:
+            content = record.read()
+
+        status = 200
+        if os.path.exists(record_file + '.status'):
+            with open(record_file + '.status', 'r') as status_file:
+                status = int(status_file.read())
+
+        return ProviderResponse(status, content)
+
+    def get_image(self, pano_id, heading, pitch=0, size=400, fov=60, key=None):
+        return self._load(image_record_name(pano_id, heading, pitch, size, fov))
+
+    def get_tile(self, pano_id, zoom, x, y, key=None):
+        return self._load(tile_record_name(pano_id, zoom, x, y))
+
+    def get_metadata(self, lat, lon, key=None):
+        return self._load(metadata_record_name(lat, lon))
+
+
+class CachedProvider:
+    """
+    Image cache on disk, the responses are served from the cache folder when they were already downloaded, and
+    requested from the provider and saved otherwise. Only successful responses are cached, the cache folder has the
+    layout of the RecordingProvider, so it can also be used by the ReplayProvider
+
+    Parameters:
+        provider: the provider doing the actual requests, e.g. GoogleProvider()
+        cache_folder: the folder of the cached responses
+    """
+
+    def __init__(self, provider, cache_folder):
+        self.provider = provider
+        self.cache_folder = cache_folder
+        self.cache = ReplayProvider(cache_folder)
+
+        if not os.path.exists(cache_folder):
+            os.makedirs(cache_folder)
+
+    def cached_image(self, pano_id, heading, pitch=0, size=400, fov=60):
+        """
+        The cached response of the GSV image, None if the image is not in the cache
+        """
+
+        response = self.cache.get_image(pano_id, heading, pitch, size, fov)
+        if response.status == 200:
+            return response
+        return None
+
+    def cached_tile(self, pano_id, zoom, x, y):
+        """
+        The cached response of the panorama tile, None if the tile is not in the cache
+        """
+
+        response = self.cache.get_tile(pano_id, zoom, x, y)
+        if response.status == 200:
+            return response
+        return None
+
+    def get_image(self, pano_id, heading, pitch=0, size=400, fov=60, key=None):
+        response = self.cached_image(pano_id, heading, pitch, size, fov)
+        if response is not None:
+            return response
+
+        response = self.provider.get_image(pano_id, heading, pitch, size, fov, key=key)
+        if response.status == 200:
+            save_record(self.cache_folder, image_record_name(pano_id, heading, pitch, size, fov), response)
+        return response
+
+    def get_tile(self, pano_id, zoom, x, y, key=None):
+        response = self.cached_tile(pano_id, zoom, x, y)
+        if response is not None:
+            return response
+
+        response = self.provider.get_tile(pano_id, zoom, x, y, key=key)
+        if response.status == 200:
+            save_record(self.cache_folder, tile_record_name(pano_id, zoom, x, y), response)
+        return response
+
+    def get_metadata(self, lat, lon, key=None):
+        # the metadata can change, it is always requested
+        return self.provider.get_metadata(lat, lon, key=key)
+
+
+def request_image(provider, key_pool, pano_id, heading, pitch=0, size=400, fov=60):
+    """
+    Request the GSV image with a key of the key pool. The images in the cache of a CachedProvider are served without
+    a key, so the reruns on the cache do not use the quota or wait for the rate limit
+    """
+
+    if isinstance(provider, CachedProvider):
+        response = provider.cached_image(pano_id, heading, pitch, size, fov)
+        if response is not None:
+            return response
+
+    return key_pool.request(lambda key: provider.get_image(pano_id, heading, pitch, size, fov, key=key))
+
+
+def request_tile(provider, key_pool, pano_id, zoom, x, y):
+    """
+    Request the tile of the panorama with a key of the key pool, the tile requests are not counted to the quota,
+    the cached tiles are served without a key, see request_image
+    """
+
+    if isinstance(provider, CachedProvider):
+        response = provider.cached_tile(pano_id, zoom, x, y)
+        if response is not None:
+            return response
+
+    return key_pool.request(lambda key: provider.get_tile(pano_id, zoom, x, y, key=key), cost=0)
+
+
+def start_replay_server(record_folder, host='127.0.0.1', port=0, latency=0.0, error_rate=0.0, seed=None):
+    """
+    Start a local HTTP stand-in of the Street View API in a background thread, which answers the same urls as the
+    GoogleProvider requests with the responses saved by the RecordingProvider. Use server.shutdown() to stop it.
+
+    Return:
+        server, url: the running server and its url, to be used as image_host and metadata_host of GoogleProvider
+
+    Parameters:
+        record_folder: the folder with the saved responses
+        host, port: the address of the server, port 0 picks a free port
+        latency, error_rate, seed: see ReplayProvider
+    """
+
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import urlparse, parse_qs
+
+    replay = ReplayProvider(record_folder, latency=latency, error_rate=error_rate, seed=seed)
+
+    class ReplayHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = {name: values[0] for name, values in parse_qs(url.query).items()}
+
+            try:
+                if url.path == '/maps/api/streetview':
+                    size = int(query.get('size', '400x400').split('x')[0])
+                    response = replay.get_image(query['pano'], int(float(query.get('heading', 0))),
+                                                int(float(query.get('pitch', 0))), size,
+                                                int(float(query.get('fov', 60))))
+                elif url.path == '/cbk' and query.get('output') == 'tile':
+                    response = replay.get_tile(query['panoid'], int(query['zoom']), int(query['x']), int(query['y']))
+                elif url.path == '/cbk':
+                    lat, lon = query['ll'].split(',')
+                    response = replay.get_metadata(lat, lon)
+                else:
+                    response = ProviderResponse(404, b'')
+            except (KeyError, ValueError):
+                response = ProviderResponse(400, b'')
+
+            self.send_response(response.status)
+            self.send_header('Content-Length', str(len(response.content)))
+            self.end_headers()
+            self.wfile.write(response.content)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), ReplayHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    return server, 'http://%s:%d' % server.server_address
+
+
+# ------------Main Function -------------------
+if __name__ == "__main__":
+    # serve the recorded responses of the kastela run on localhost, and point the GoogleProvider to it
+    record_folder = '..\\kastela\\records'
+    replay_server, replay_url = start_replay_server(record_folder, port=8000, latency=(0.05, 0.2), error_rate=0.01)
+    print('The replay server is running on:', replay_url)
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        replay_server.shutdown()
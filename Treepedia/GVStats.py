@@ -116,50 +116,16 @@ def Read_GVI_res(GVI_Res):
 
 ## ----------------- Main function ------------------------
 if __name__ == "__main__":
-    import os
     import sys
-    import numpy as np
-    import matplotlib.pyplot as plt
-    import seaborn as sns
-
-
-    inputGVIres = r'C:\\Users\\rangu_uhpmatw\\Documents\\GitHub\\customs\\Treepedia_Public\\SA\\SA_GVR'
-    outputShapefile = 'C:\\Users\\rangu_uhpmatw\\Documents\\GitHub\\customs\\Treepedia_Public\\SA\\SA_GVR.shp'
-    lyrname = 'greenView'
-    [_,_,_,_,SA] = Read_GVI_res(inputGVIres)
-    print ('The length of the SA is:', len(SA))
-    SA = np.array(SA).astype(np.float)
-    print(np.average(SA))
-    print(np.percentile(SA, 0))
-    print(np.percentile(SA, 25))
-    print(np.percentile(SA, 50))
-    print(np.percentile(SA, 75))
-    print(np.percentile(SA, 100))
-
-    inputGVIres = r'C:\\Users\\rangu_uhpmatw\\Documents\\GitHub\\customs\\Treepedia_Public\\LB\\LB_GVR'
-    outputShapefile = 'C:\\Users\\rangu_uhpmatw\\Documents\\GitHub\\customs\\Treepedia_Public\\LB\\LB_GVR.shp'
-    [_,_,_,_,LB] = Read_GVI_res(inputGVIres)
-    print ('The length of the LB is:', len(LB))
-    LB = np.array(LB).astype(np.float)
-    print(np.average(LB))
-    print(np.percentile(LB, 0))
-    print(np.percentile(LB, 25))
-    print(np.percentile(LB, 50))
-    print(np.percentile(LB, 75))
-    print(np.percentile(LB, 100))
-
-    sns.set_style('whitegrid')
-    sns.distplot(SA)
-    plt.show()
-    sns.distplot(LB)
-    plt.show()
-    
-
-    plt.boxplot([SA,LB], vert=False, whis=3.1)
-    plt.yticks([1, 2], ['Santa Ana', 'Long Beach'])
-    plt.show()
-
-##    plt.boxplot(LB, vert=False)
-##    plt.show()
+    if __package__:
+        from . import MultiCity
+    else:
+        import MultiCity
+
+    # the cities are listed in a json manifest with their output folders (see MultiCity.read_manifest), the
+    # distributions, the quantiles and the box plots of the cities are computed from their columnar results
+    manifest = sys.argv[1] if len(sys.argv) > 1 else 'cities.json'
+    report = MultiCity.report_from_manifest(manifest, 'cities_report.json')
+    MultiCity.plot_report(report)
 
     print('Done!!!')
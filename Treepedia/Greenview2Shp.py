@@ -114,6 +114,45 @@ def read_gvi_res(gvi_res):
     return pano_id_lst, pano_date_lst, pano_lon_lst, pano_lat_lst, green_view_lst
 
 
+def write_gvi_columnar(npz_file, pano_id_lst, pano_date_lst, lon_lst, lat_lst, green_view_lst, **extra_columns):
+    """
+    Save the green view index results as columns (one numpy array per attribute) in a compressed npz file, which
+    is much faster to load and compare than parsing the txt files again
+
+    Parameters:
+        npz_file: the output npz file
+        pano_id_lst, pano_date_lst, lon_lst, lat_lst, green_view_lst: the lists from read_gvi_res
+        extra_columns: other columns of the same length, e.g. pointID or year
+    """
+
+    import numpy
+
+    columns = {'panoID': numpy.array(pano_id_lst, dtype=str),
+               'panoDate': numpy.array(pano_date_lst, dtype=str),
+               'longitude': numpy.array(lon_lst, dtype=float),
+               'latitude': numpy.array(lat_lst, dtype=float),
+               'greenView': numpy.array(green_view_lst, dtype=float)}
+
+    for name, values in extra_columns.items():
+        columns[name] = numpy.asarray(values)
+
+    numpy.savez_compressed(npz_file, **columns)
+
+
+def read_gvi_columnar(npz_file):
+    """
+    Load the green view index results saved by write_gvi_columnar
+
+    Return:
+        dictionary of the column name and the numpy array of the column
+    """
+
+    import numpy
+
+    with numpy.load(npz_file) as columns:
+        return {name: columns[name] for name in columns.files}
+
+
 def create_point_feature_ogr(output_shapefile, lon_lst, lat_lst, pano_id_list, pano_date_list, green_view_lst, lyrname):
     """
     Create a shapefile based on the template of inputShapefile
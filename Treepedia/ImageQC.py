@@ -0,0 +1,146 @@
+# This script is used to reject the unusable GSV images before the segmentation. The checks are cheap: the pano id
+# (the user uploaded photospheres, often indoor, have no 22 characters Street View id), the HTTP status and the size
+# of the response, the hash of known placeholder images (e.g. the grey "no imagery" image), the image size, and the
+# brightness and the entropy of a subsampled grey histogram. Every rejected image gets a reason code.
+
+import collections
+import hashlib
+import os
+
+import numpy
+
+# the reason codes of the rejected images
+NOT_STREET_VIEW = 'not_street_view'
+FETCH_ERROR = 'fetch_error'
+HTTP_ERROR = 'http_error'
+SERVER_ERROR = 'server_error'
+TOO_SMALL = 'too_small'
+PLACEHOLDER = 'placeholder'
+DECODE_ERROR = 'decode_error'
+BAD_SIZE = 'bad_size'
+DARK = 'dark'
+OVEREXPOSED = 'overexposed'
+LOW_ENTROPY = 'low_entropy'
+TOO_FEW_IMAGES = 'too_few_images'
+
+# the images rejected for these reasons are downloaded again, the others would be the same again
+RETRY_REASONS = (FETCH_ERROR, SERVER_ERROR, TOO_SMALL)
+
+
+class QualityControl:
+    """
+    The checks of the GSV images and the count of the rejected images by reason
+
+    Parameters:
+        blacklist_file: the txt file of the sha1 hashes of the placeholder images, one hash per line, the file is
+        updated by add_placeholder
+        image_size: the expected width and height of the images
+        min_bytes: the images with less bytes are truncated or empty
+        dark, bright: the images with the mean grey value (0 - 255) below dark or above bright are rejected
+        min_entropy: the images with the entropy of the 64 bins grey histogram below min_entropy bits are rejected,
+        e.g. single colour placeholders
+        retries: the number of the downloads again of the images rejected for a RETRY_REASONS reason
+        min_valid_images: the panoramas with less valid images are rejected, None to require all images
+    """
+
+    def __init__(self, blacklist_file=None, image_size=400, min_bytes=2000, dark=20.0, bright=235.0,
+                 min_entropy=2.0, retries=2, min_valid_images=None):
+        self.blacklist_file = blacklist_file
+        self.image_size = image_size
+        self.min_bytes = min_bytes
+        self.dark = dark
+        self.bright = bright
+        self.min_entropy = min_entropy
+        self.retries = retries
+        self.min_valid_images = min_valid_images
+        self.reasons = collections.Counter()
+
+        self.blacklist = set()
+        if blacklist_file is not None and os.path.exists(blacklist_file):
+            with open(blacklist_file, 'r') as lines:
+                self.blacklist = set(line.strip() for line in lines if len(line.strip()) > 0)
+
+    def __getstate__(self):
+        # the counts stay in the main process, the workers only check the images
+        state = dict(self.__dict__)
+        state['reasons'] = collections.Counter()
+        return state
+
+    def add_placeholder(self, content):
+        """
+        Add the image to the blacklist of the placeholder images and save the blacklist
+        """
+
+        self.blacklist.add(hashlib.sha1(content).hexdigest())
+        if self.blacklist_file is not None:
+            with open(self.blacklist_file, 'w') as blacklist:
+                blacklist.write(''.join(image_hash + '\n' for image_hash in sorted(self.blacklist)))
+
+    def check_pano_id(self, pano_id):
+        """
+        Return NOT_STREET_VIEW for the panoramas which are not Street View panoramas, None otherwise
+        """
+
+        if len(pano_id) != 22:
+            return NOT_STREET_VIEW
+        return None
+
+    def check_response(self, status, content):
+        """
+        Check the downloaded image before it is decoded, return the reason code or None if the image is fine
+        """
+
+        if status >= 500:
+            return SERVER_ERROR
+        if status != 200:
+            return HTTP_ERROR
+        if len(content) < self.min_bytes:
+            return TOO_SMALL
+        if hashlib.sha1(content).hexdigest() in self.blacklist:
+            return PLACEHOLDER
+        return None
+
+    def check_image(self, img, image_size=None):
+        """
+        Check the decoded image, return the reason code or None if the image is fine
+
+        Parameters:
+            img: the numpy array image
+            image_size: the expected width and height, the default is the image_size of the checks
+        """
+
+        if image_size is None:
+            image_size = self.image_size
+        if img.ndim != 3 or img.shape[0] != image_size or img.shape[1] != image_size:
+            return BAD_SIZE
+
+        # the grey histogram of every 4th pixel
+        sample = img[::4, ::4]
+        grey = (sample[:, :, 0] * 0.299 + sample[:, :, 1] * 0.587 + sample[:, :, 2] * 0.114).astype(numpy.uint8)
+        hist = numpy.bincount(grey.ravel() >> 2, minlength=64)
+
+        mean_grey = grey.mean()
+        if mean_grey < self.dark:
+            return DARK
+        if mean_grey > self.bright:
+            return OVEREXPOSED
+
+        p_hist = hist[hist > 0] * 1.0 / grey.size
+        if -(p_hist * numpy.log2(p_hist)).sum() < self.min_entropy:
+            return LOW_ENTROPY
+
+        return None
+
+    def record(self, reason):
+        self.reasons[reason] += 1
+
+    def report(self):
+        """
+        Print the number of the rejected images by reason
+        """
+
+        if len(self.reasons) == 0:
+            print('Quality control: no rejected images')
+        else:
+            print('Quality control: rejected %s' % ', '.join('%d %s' % (num, reason) for reason, num in
+                                                             sorted(self.reasons.items())))
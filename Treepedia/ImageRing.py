@@ -0,0 +1,156 @@
+# This script is used to hand the decoded GSV images from the download threads to the classification processes
+# without copying them. The images are decoded into the fixed size slots of a ring buffer in shared memory, only the
+# index of the slot is sent to the worker process, and the slot is reused when the worker is done with it. The
+# number of the slots bounds the memory of the images in flight, whatever the number of the threads.
+
+import queue
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy
+
+# the shared memory blocks attached in this worker process, by name
+_attached = {}
+
+
+def run_on_slot(function, shm_name, slot_shape, index, *args):
+    """
+    Run the function on the image in the slot of the ring buffer, in the worker process. The shared memory is
+    attached once per process
+
+    Parameters:
+        function: the function of the image and the args, e.g. GreenView_Calculate.vegetation_classification
+        shm_name, slot_shape: the name of the shared memory and the shape of the slots of the ImageRing
+        index: the index of the slot
+    """
+
+    if shm_name not in _attached:
+        _attached[shm_name] = shared_memory.SharedMemory(name=shm_name)
+
+    slot_bytes = int(numpy.prod(slot_shape))
+    img = numpy.ndarray(slot_shape, dtype=numpy.uint8, buffer=_attached[shm_name].buf, offset=index * slot_bytes)
+
+    return function(img, *args)
+
+
+class ImageRing:
+    """
+    The ring buffer of the image slots in shared memory, a slot is acquired by one thread at a time and released
+    when the image is not needed any more
+
+    Parameters:
+        num_slots: the number of the slots
+        slot_size: the width and height of the images
+    """
+
+    def __init__(self, num_slots, slot_size=400):
+        self.num_slots = num_slots
+        self.slot_shape = (slot_size, slot_size, 3)
+        self.slot_bytes = slot_size * slot_size * 3
+        self.shm = shared_memory.SharedMemory(create=True, size=num_slots * self.slot_bytes)
+
+        self.free = queue.Queue()
+        for index in range(num_slots):
+            self.free.put(index)
+
+    def acquire(self):
+        """
+        Wait until a slot is free and return its index
+        """
+
+        return self.free.get()
+
+    def release(self, index):
+        self.free.put(index)
+
+    def slot(self, index):
+        """
+        The numpy array of the image in the slot
+        """
+
+        return numpy.ndarray(self.slot_shape, dtype=numpy.uint8, buffer=self.shm.buf, offset=index * self.slot_bytes)
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+class RingClassifier:
+    """
+    Download and decode the GSV images in threads, and classify them in worker processes through the ImageRing
+
+    Parameters:
+        classify_workers: the number of the classification processes
+        num_slots: the number of the image slots, the default is two per worker, so a worker does not wait for the
+        next image
+        slot_size: the width and height of the decoded images, the working_size or the size of the GSV images
+        fetch_threads: the number of the download threads, the default is the number of the slots
+        lut_bits: see GreenView_Calculate.vegetation_classification
+    """
+
+    def __init__(self, classify_workers, num_slots=None, slot_size=400, fetch_threads=None, lut_bits=None):
+        if num_slots is None:
+            num_slots = 2 * classify_workers
+        if fetch_threads is None:
+            fetch_threads = num_slots
+
+        self.lut_bits = lut_bits
+        self.ring = ImageRing(num_slots, slot_size)
+        self.fetch_pool = ThreadPoolExecutor(fetch_threads)
+        self.classify_pool = ProcessPoolExecutor(classify_workers)
+
+    def fetch_and_classify(self, fetch, working_size=None, result_cache=None):
+        """
+        Download the image with fetch, decode it into a free slot and classify it in a worker process
+
+        Return:
+            the percentage of the green vegetation pixels of the image
+        """
+
+        if __package__:
+            from .GreenView_Calculate import decode_image, vegetation_classification
+        else:
+            from GreenView_Calculate import decode_image, vegetation_classification
+
+        content = fetch()
+
+        key = None
+        if result_cache is not None:
+            if __package__:
+                from . import ResultCache
+            else:
+                import ResultCache
+
+            key = ResultCache.image_hash(content)
+            green_percent = result_cache.lookup(key)
+            if green_percent is not None:
+                return green_percent
+
+        index = self.ring.acquire()
+        try:
+            decode_image(content, working_size, self.ring.slot(index))
+            green_percent = self.classify_pool.submit(run_on_slot, vegetation_classification, self.ring.shm.name,
+                                                      self.ring.slot_shape, index, False, self.lut_bits).result()
+        finally:
+            self.ring.release(index)
+
+        if result_cache is not None:
+            result_cache.store(key, green_percent)
+
+        return green_percent
+
+    def green_percents(self, fetches, working_size=None, result_cache=None):
+        """
+        Return the list of the percentages of the green vegetation pixels of the images downloaded by the fetches,
+        functions returning the bytes of the images
+        """
+
+        futures = [self.fetch_pool.submit(self.fetch_and_classify, fetch, working_size, result_cache)
+                   for fetch in fetches]
+
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        self.fetch_pool.shutdown()
+        self.classify_pool.shutdown()
+        self.ring.close()
@@ -0,0 +1,303 @@
+# This script is used to refresh the green view index of a city months after the previous run. The fresh metadata
+# is compared with the metadata of the previous run by the sample point, only the new or changed panoramas are
+# downloaded and classified, and the green view index of the unchanged panoramas is carried forward.
+
+import os
+import shutil
+
+
+def read_metadata_by_point(metadata_folder):
+    """
+    Read the GSV metadata txt files written by metadataCollector into a dictionary keyed by the sample point
+
+    Return:
+        dictionary of the pointID and the (pano_id, pano_date, lon, lat) of the sample point
+
+    Parameters:
+        metadata_folder: the folder of the GSV metadata txt files
+    """
+
+    if __package__:
+        from .metadataCollector import parse_metadata_line
+    else:
+        from metadataCollector import parse_metadata_line
+
+    points = {}
+
+    for txt_file in os.listdir(metadata_folder):
+        if not txt_file.endswith('.txt'):
+            continue
+
+        with open(os.path.join(metadata_folder, txt_file), 'r') as lines:
+            for line in lines:
+                if 'pointID:' not in line:
+                    raise ValueError('The metadata in %s has no pointID, collect it again with metadataCollector'
+                                     % txt_file)
+
+                metadata = parse_metadata_line(line)
+                points[int(metadata['pointID'])] = (metadata['panoID'], metadata['panoDate'],
+                                                    metadata['longitude'], metadata['latitude'])
+
+    return points
+
+
+def read_gvi_by_pano(gvi_folder):
+    """
+    Read the green view index txt files into a dictionary keyed by the panorama id, the panoramas with failed
+    green view index (negative values) are left out, so they are computed again
+    """
+
+    if __package__:
+        from .Greenview2Shp import read_gvi_res
+    else:
+        from Greenview2Shp import read_gvi_res
+
+    pano_id_lst, _, _, _, green_view_lst = read_gvi_res(gvi_folder)
+
+    return {pano_id: float(green_view) for pano_id, green_view in zip(pano_id_lst, green_view_lst)}
+
+
+def read_gvi_lines(gvi_folder):
+    """
+    Read all green view index values of the txt files, including the failed ones, into a dictionary keyed by the
+    panorama id
+    """
+
+    gvi = {}
+
+    for txt_file in os.listdir(gvi_folder):
+        if not txt_file.endswith('.txt'):
+            continue
+
+        with open(os.path.join(gvi_folder, txt_file), 'r') as lines:
+            for line in lines:
+                if 'greenview:' not in line:
+                    continue
+                gvi[line.split()[1]] = float(line.split('greenview:')[1])
+
+    return gvi
+
+
+def create_diff_feature_ogr(output_shapefile, diff_lst, lyrname='greenViewDiff'):
+    """
+    Create the point shapefile of the green view index changes, with the old and the new panorama and green view
+    index of every new, changed or removed sample point
+
+    Parameters:
+        output_shapefile: the file path of the output shapefile
+        diff_lst: list of (point_id, status, lon, lat, old_pano_id, new_pano_id, old_gvi, new_gvi), the missing
+        values are None
+        lyrname: the name of the layer
+    """
+
+    import ogr
+    import osr
+
+    driver = ogr.GetDriverByName("ESRI Shapefile")
+
+    if os.path.exists(output_shapefile):
+        driver.DeleteDataSource(output_shapefile)
+
+    data_source = driver.CreateDataSource(output_shapefile)
+    target_spatial_ref = osr.SpatialReference()
+    target_spatial_ref.ImportFromEPSG(4326)
+
+    out_layer = data_source.CreateLayer(lyrname, target_spatial_ref, ogr.wkbPoint)
+    out_layer.CreateField(ogr.FieldDefn('PntNum', ogr.OFTInteger))
+    out_layer.CreateField(ogr.FieldDefn('status', ogr.OFTString))
+    out_layer.CreateField(ogr.FieldDefn('oldPanoID', ogr.OFTString))
+    out_layer.CreateField(ogr.FieldDefn('newPanoID', ogr.OFTString))
+    out_layer.CreateField(ogr.FieldDefn('oldGV', ogr.OFTReal))
+    out_layer.CreateField(ogr.FieldDefn('newGV', ogr.OFTReal))
+    out_layer.CreateField(ogr.FieldDefn('diffGV', ogr.OFTReal))
+
+    feature_defn = out_layer.GetLayerDefn()
+    for point_id, status, lon, lat, old_pano_id, new_pano_id, old_gvi, new_gvi in diff_lst:
+        point = ogr.Geometry(ogr.wkbPoint)
+        point.AddPoint(float(lon), float(lat))
+
+        out_feature = ogr.Feature(feature_defn)
+        out_feature.SetGeometry(point)
+        out_feature.SetField('PntNum', point_id)
+        out_feature.SetField('status', status)
+        out_feature.SetField('oldPanoID', old_pano_id if old_pano_id is not None else '')
+        out_feature.SetField('newPanoID', new_pano_id if new_pano_id is not None else '')
+        out_feature.SetField('oldGV', old_gvi if old_gvi is not None else -999)
+        out_feature.SetField('newGV', new_gvi if new_gvi is not None else -999)
+
+        if old_gvi is not None and new_gvi is not None:
+            out_feature.SetField('diffGV', new_gvi - old_gvi)
+        else:
+            out_feature.SetField('diffGV', -999)
+
+        out_layer.CreateFeature(out_feature)
+        out_feature.Destroy()
+
+    data_source.Destroy()
+
+
+def incremental_green_view(prev_metadata_folder, prev_gvi_folder, new_metadata_folder, out_txt_root, greenmonth,
+                           key_file, diff_shapefile=None, num_headings=6, **gvi_kwargs):
+    """
+    Compute the green view index for the fresh metadata, downloading and classifying only the panoramas of the
+    sample points which are new or whose pano_id or panoDate changed since the previous run. The green view index
+    of the panoramas of the unchanged sample points is copied from the previous results, the panoramas which failed
+    in the previous run are computed again.
+
+    Return:
+        dictionary with the number of new, changed, unchanged and removed sample points, the number of computed
+        and carried panoramas and the number of saved image requests
+
+    Parameters:
+        prev_metadata_folder: the folder of the GSV metadata txt files of the previous run
+        prev_gvi_folder: the folder of the green view index txt files of the previous run
+        new_metadata_folder: the folder of the fresh GSV metadata txt files
+        out_txt_root: the output folder of the green view index txt files, with the same files as a full run
+        greenmonth, key_file: see green_view_computing_ogr_6horizon
+        diff_shapefile: the output shapefile of the green view index changes, None to not write it
+        num_headings: the number of images of one panorama, to report the saved requests
+        gvi_kwargs: other parameters of green_view_computing_ogr_6horizon, e.g. provider or key_pool
+    """
+
+    if __package__:
+        from .GreenView_Calculate import green_view_computing_ogr_6horizon
+        from .metadataCollector import parse_metadata_line
+    else:
+        from GreenView_Calculate import green_view_computing_ogr_6horizon
+        from metadataCollector import parse_metadata_line
+
+    prev_points = read_metadata_by_point(prev_metadata_folder)
+    prev_gvi = read_gvi_by_pano(prev_gvi_folder)
+
+    # the metadata of the new and changed sample points is written to a temporary folder, which is computed as a
+    # normal run
+    changed_metadata_folder = os.path.join(out_txt_root, 'changed_metadata')
+    changed_gvi_folder = os.path.join(out_txt_root, 'changed_gvi')
+    for folder in [changed_metadata_folder, changed_gvi_folder]:
+        if os.path.exists(folder):
+            shutil.rmtree(folder)
+        os.makedirs(folder)
+
+    new_points = {}
+    status_lst = {}
+    new_lines = {}
+
+    for txt_file in os.listdir(new_metadata_folder):
+        if not txt_file.endswith('.txt'):
+            continue
+
+        new_lines[txt_file] = []
+        with open(os.path.join(new_metadata_folder, txt_file), 'r') as lines:
+            for line in lines:
+                if 'pointID:' not in line:
+                    raise ValueError('The metadata in %s has no pointID, collect it again with metadataCollector'
+                                     % txt_file)
+
+                metadata = parse_metadata_line(line)
+                point_id = int(metadata['pointID'])
+                pano_id, pano_date = metadata['panoID'], metadata['panoDate']
+                new_points[point_id] = (pano_id, pano_date, metadata['longitude'], metadata['latitude'])
+                new_lines[txt_file].append((pano_id, line))
+
+                if point_id not in prev_points:
+                    status_lst[point_id] = 'new'
+                elif prev_points[point_id][:2] != (pano_id, pano_date):
+                    status_lst[point_id] = 'changed'
+                else:
+                    status_lst[point_id] = 'unchanged'
+
+    # the panoramas of the new and changed sample points are computed again, also when the previous run has a
+    # panorama with the same id, e.g. with another panoDate. Only the panoramas of the unchanged sample points are
+    # carried forward
+    recomputed_panos = set(new_points[point_id][0] for point_id, status in status_lst.items()
+                           if status != 'unchanged')
+    carried_panos = set(new_points[point_id][0] for point_id, status in status_lst.items()
+                        if status == 'unchanged' and new_points[point_id][0] in prev_gvi) - recomputed_panos
+
+    for txt_file, file_lines in new_lines.items():
+        with open(os.path.join(changed_metadata_folder, txt_file), 'w') as changed_txt:
+            for pano_id, line in file_lines:
+                if pano_id not in carried_panos:
+                    changed_txt.write(line)
+
+    green_view_computing_ogr_6horizon(changed_metadata_folder, changed_gvi_folder, greenmonth, key_file,
+                                      **gvi_kwargs)
+    new_gvi = read_gvi_lines(changed_gvi_folder)
+    computed_panos = set(new_gvi.keys()) - carried_panos
+
+    # write the result txt files, with the same names and the same panoramas as a full run
+    pano_done = set()
+    for txt_file in os.listdir(changed_metadata_folder):
+        with open(os.path.join(new_metadata_folder, txt_file), 'r') as lines, \
+                open(os.path.join(out_txt_root, 'GV_' + txt_file), 'w') as gv_res_txt:
+            for line in lines:
+                metadata = parse_metadata_line(line)
+                pano_id, pano_date = metadata['panoID'], metadata['panoDate']
+                lon, lat = metadata['longitude'], metadata['latitude']
+
+                if pano_id in pano_done or len(lon) < 3 or pano_date[-2:] not in greenmonth:
+                    continue
+
+                if pano_id in carried_panos:
+                    green_view_val = prev_gvi[pano_id]
+                elif pano_id in new_gvi:
+                    green_view_val = new_gvi[pano_id]
+                else:
+                    continue
+
+                pano_done.add(pano_id)
+                line_txt = 'panoID: %s panoDate: %s longitude: %s latitude: %s, greenview: %s\n' % (
+                    pano_id, pano_date, lon, lat, green_view_val)
+                gv_res_txt.write(line_txt)
+
+    shutil.rmtree(changed_metadata_folder)
+    shutil.rmtree(changed_gvi_folder)
+
+    # the layer of the green view index changes
+    diff_lst = []
+    for point_id in sorted(set(prev_points.keys()) | set(new_points.keys())):
+        old_pano_id, new_pano_id = None, None
+        if point_id in prev_points:
+            old_pano_id, _, lon, lat = prev_points[point_id]
+        if point_id in new_points:
+            new_pano_id, _, lon, lat = new_points[point_id]
+
+        status = status_lst.get(point_id, 'removed')
+        if status == 'unchanged':
+            continue
+
+        new_green_view = new_gvi.get(new_pano_id, prev_gvi.get(new_pano_id))
+        if new_green_view is not None and new_green_view < 0:
+            new_green_view = None
+
+        diff_lst.append((point_id, status, lon, lat, old_pano_id, new_pano_id, prev_gvi.get(old_pano_id),
+                         new_green_view))
+
+    if diff_shapefile is not None:
+        create_diff_feature_ogr(diff_shapefile, diff_lst)
+
+    report = {'new': list(status_lst.values()).count('new'),
+              'changed': list(status_lst.values()).count('changed'),
+              'unchanged': list(status_lst.values()).count('unchanged'),
+              'removed': len(set(prev_points.keys()) - set(new_points.keys())),
+              'computed_panos': len(computed_panos),
+              'carried_panos': len(carried_panos),
+              'saved_requests': len(carried_panos) * num_headings}
+
+    print('Computed %d panoramas, carried forward %d panoramas, saved %d image requests' % (
+        report['computed_panos'], report['carried_panos'], report['saved_requests']))
+
+    return report
+
+
+# ------------Main Function -------------------
+if __name__ == "__main__":
+    root = '..\\kastela'
+    prev_metadata = os.path.join(root, 'metadata')
+    prev_gvi_values = os.path.join(root, 'GVI_values')
+    new_metadata = os.path.join(root, 'metadata_refresh')
+    new_gvi_values = os.path.join(root, 'GVI_values_refresh')
+    greenmonth = ['01', '02', '03', '04', '05', '06', '07', '08', '09', '10', '11', '12']
+
+    incremental_green_view(prev_metadata, prev_gvi_values, new_metadata, new_gvi_values, greenmonth, 'keys.txt',
+                           diff_shapefile=os.path.join(root, 'GVI_diff.shp'))
@@ -0,0 +1,301 @@
+# This script is used to spread the GSV requests over several Google API keys. Each key can only request 25,000
+# images every 24 hours, the pool keeps the number of used requests for each key in a json file, so the usage is
+# kept between the runs, rotates to another key when a key gets a quota (403) or rate (429) response and waits for
+# the quota reset when all keys are used up, instead of sending requests which would fail. The keys rejected for
+# another reason (invalid, not authorized or without billing) are dropped, and the run stops when no key is left.
+
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+# the statuses of the responses which mean the key is over its quota or rate limit
+QUOTA_STATUSES = (403, 429)
+
+# a 403 response is a quota response only if its message has one of these words, otherwise the key is invalid, not
+# authorized for the API or its project has no billing
+QUOTA_MESSAGES = (b'quota', b'limit')
+
+
+class KeysRejected(Exception):
+    """
+    All keys of the pool got a 403 response which is not a quota response, the requests would fail until the keys
+    are fixed
+    """
+
+
+def is_quota_response(status, content):
+    """
+    Whether the response means the key is over its quota or rate limit
+    """
+
+    if status == 403:
+        return content is None or any(word in content.lower() for word in QUOTA_MESSAGES)
+    return status in QUOTA_STATUSES
+
+
+def _lock_file(lock):
+    """
+    Wait for the exclusive lock of the open file, the lock is shared by all processes
+    """
+
+    if fcntl is not None:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        return
+
+    lock.seek(0)
+    while True:
+        try:
+            msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            # LK_LOCK gives up after 10 seconds
+            pass
+
+
+def _unlock_file(lock):
+    if fcntl is not None:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+    else:
+        lock.seek(0)
+        msvcrt.locking(lock.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class KeyPool:
+    """
+    Pool of the Google API keys with per key usage tracking and a shared rate limit
+
+    Parameters:
+        keys: the list of the API keys
+        usage_file: the json file storing the daily usage of every key, None to keep the usage in memory only
+        daily_quota: the number of requests each key can make in a day
+        min_interval: the minimum time in seconds between two requests of the whole pool
+        backoff: the first waiting time in seconds for a key which returned a 429 response, doubled for every
+        following 429 response up to max_backoff
+        max_backoff: the longest waiting time in seconds for a key
+        reset_utc_offset: the UTC offset in hours of the time zone where the quota is reset at midnight, Google resets
+        the quota at midnight Pacific Time
+    """
+
+    def __init__(self, keys, usage_file=None, daily_quota=25000, min_interval=0.0, backoff=60.0, max_backoff=3600.0,
+                 reset_utc_offset=-8):
+        if len(keys) == 0:
+            raise ValueError('The key pool needs at least one key')
+
+        self.keys = list(keys)
+        self.usage_file = usage_file
+        self.daily_quota = daily_quota
+        self.min_interval = min_interval
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.reset_utc_offset = reset_utc_offset
+
+        self.condition = threading.Condition()
+        self.day = self._today()
+        self.usage = {key: 0 for key in self.keys}
+        self.unsaved = {key: 0 for key in self.keys}
+        self.blocked_until = {key: 0.0 for key in self.keys}
+        self.failures = {key: 0 for key in self.keys}
+        self.rejected = set()
+        self.next_request = 0.0
+
+        self._load()
+
+    @classmethod
+    def from_file(cls, key_file, usage_file=None, **kwargs):
+        """
+        Create the pool from the key file, each key is one row. The usage is stored next to the key file by default
+        """
+
+        with open(key_file, 'r') as lines:
+            keys = [line.strip() for line in lines if line.strip() != '']
+
+        if usage_file is None:
+            usage_file = key_file + '.usage.json'
+
+        return cls(keys, usage_file, **kwargs)
+
+    def _today(self):
+        return int((time.time() + self.reset_utc_offset * 3600) // 86400)
+
+    def _seconds_to_reset(self):
+        return (self._today() + 1) * 86400 - (time.time() + self.reset_utc_offset * 3600)
+
+    def _load(self):
+        if self.usage_file is None or not os.path.exists(self.usage_file):
+            return
+
+        with open(self.usage_file, 'r') as usage_json:
+            saved = json.load(usage_json)
+
+        if saved.get('day') == self.day:
+            for key, used in saved.get('usage', {}).items():
+                if key in self.usage:
+                    self.usage[key] = used
+
+    def save(self):
+        """
+        Write the usage to the usage file. Only the requests made since the last save are added to the usage in
+        the file, so that several processes can share one usage file, the read and the write of the file are done
+        under the lock of the usage_file.lock file. The condition uses a reentrant lock, so it can also be called
+        while holding it
+        """
+
+        if self.usage_file is None:
+            return
+
+        with self.condition, open(self.usage_file + '.lock', 'a') as lock:
+            _lock_file(lock)
+            try:
+                saved = {'day': self.day, 'usage': {}}
+                if os.path.exists(self.usage_file):
+                    with open(self.usage_file, 'r') as usage_json:
+                        saved = json.load(usage_json)
+
+                if saved.get('day') != self.day:
+                    saved = {'day': self.day, 'usage': {}}
+
+                for key in self.keys:
+                    saved['usage'][key] = saved['usage'].get(key, 0) + self.unsaved[key]
+                    self.usage[key] = max(self.usage[key], saved['usage'][key])
+                    self.unsaved[key] = 0
+
+                temp_file = '%s.%d.%d.tmp' % (self.usage_file, os.getpid(), threading.get_ident())
+                with open(temp_file, 'w') as usage_json:
+                    json.dump(saved, usage_json)
+                os.replace(temp_file, self.usage_file)
+            finally:
+                _unlock_file(lock)
+
+    def _new_day(self):
+        # the quota was reset, start counting from zero
+        self.day = self._today()
+        for key in self.keys:
+            self.usage[key] = 0
+            self.unsaved[key] = 0
+            self.failures[key] = 0
+
+    def remaining(self):
+        """
+        The number of requests left today for all keys together
+        """
+
+        with self.condition:
+            if self._today() != self.day:
+                self._new_day()
+            return sum(max(self.daily_quota - used, 0) for used in self.usage.values())
+
+    def acquire(self, cost=1):
+        """
+        Wait until a key with enough quota is available and the rate limit allows another request, then return the
+        key with the most requests left. The cost is added to the usage of the key. Raise KeysRejected if all keys
+        were rejected
+
+        Parameters:
+            cost: the number of quota units the request uses, 0 for requests which are not counted to the quota
+        """
+
+        with self.condition:
+            while True:
+                if self._today() != self.day:
+                    self._new_day()
+
+                keys = [key for key in self.keys if key not in self.rejected]
+                if len(keys) == 0:
+                    raise KeysRejected('All keys were rejected with a 403 response without a quota message')
+
+                now = time.time()
+                available = [key for key in keys
+                             if self.usage[key] + cost <= self.daily_quota and self.blocked_until[key] <= now]
+
+                if len(available) > 0:
+                    wait = self.next_request - now
+                    if wait <= 0:
+                        break
+                elif any(self.usage[key] + cost <= self.daily_quota for key in keys):
+                    # all keys with quota left are backing off, wait for the first one
+                    wait = min(self.blocked_until[key] for key in keys
+                               if self.usage[key] + cost <= self.daily_quota) - now
+                else:
+                    # all keys are used up for today, wait for the quota reset
+                    print('All keys are over the quota, waiting %d s for the reset' % self._seconds_to_reset())
+                    self.save()
+                    wait = self._seconds_to_reset() + 1
+
+                self.condition.wait(max(wait, 0.001))
+
+            key = max(available, key=lambda k: self.daily_quota - self.usage[k])
+            self.usage[key] += cost
+            self.unsaved[key] += cost
+            self.next_request = now + self.min_interval
+
+            if sum(self.unsaved.values()) >= 100:
+                self.save()
+
+            return key
+
+    def report(self, key, status, content=None):
+        """
+        Report the status of the response of the request made with the key. A 403 quota response (see
+        is_quota_response) means the key is over its daily quota, so it is not used until the reset, another 403
+        response means the key is rejected, so it is not used again. A 429 response makes the key wait for an
+        increasing backoff time
+
+        Parameters:
+            key: the key of the request
+            status, content: the status and the body of the response, None for the body of a quota response
+        """
+
+        with self.condition:
+            if status == 403 and not is_quota_response(status, content):
+                print('The key %s was rejected (403: %r), it is not used again' % (key, (content or b'')[:200]))
+                self.rejected.add(key)
+            elif status == 403:
+                print('The key %s got a 403 response, it is not used until the quota reset' % key)
+                self.unsaved[key] += max(self.daily_quota - self.usage[key], 0)
+                self.usage[key] = self.daily_quota
+                self.save()
+            elif status == 429:
+                wait = min(self.backoff * 2 ** self.failures[key], self.max_backoff)
+                self.failures[key] += 1
+                self.blocked_until[key] = time.time() + wait
+            else:
+                self.failures[key] = 0
+
+            self.condition.notify_all()
+
+    def request(self, fetch, cost=1, max_attempts=None):
+        """
+        Make a request with a key from the pool, and repeat it with another key while the response is a quota
+        response or the key was rejected. Raise KeysRejected if all keys were rejected
+
+        Return:
+            the response of the last attempt
+
+        Parameters:
+            fetch: function taking the key and returning a response with status, e.g.
+            lambda key: provider.get_image(pano_id, heading, key=key)
+            cost: see acquire
+            max_attempts: the maximum number of attempts, the default is three times the number of keys in the pool
+        """
+
+        if max_attempts is None:
+            max_attempts = 3 * len(self.keys)
+
+        response = None
+        for attempt in range(max_attempts):
+            key = self.acquire(cost)
+            response = fetch(key)
+            self.report(key, response.status, response.content)
+
+            if response.status not in QUOTA_STATUSES:
+                break
+
+        return response
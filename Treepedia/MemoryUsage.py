@@ -0,0 +1,62 @@
+# This script is used to report the peak memory of the processing stages, to check that the processing of very
+# large point shapefiles stays within the memory of the machine.
+
+import contextlib
+import sys
+import time
+import tracemalloc
+
+
+def peak_rss_mb():
+    """
+    The peak resident memory of the process in MB since its start, None if it is not available (Windows)
+    """
+
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    if sys.platform == 'darwin':
+        return peak / 1024.0 / 1024.0
+    return peak / 1024.0
+
+
+@contextlib.contextmanager
+def memory_stage(name, enabled=True):
+    """
+    Report the run time and the peak memory allocated during the stage (traced with tracemalloc, which also traces
+    the numpy arrays) and the peak resident memory of the process, e.g.
+
+        with memory_stage('read points'):
+            points = read_points(shapefile)
+
+    Parameters:
+        name: the name of the stage in the report
+        enabled: False to not trace the stage, tracing makes the allocations slower
+    """
+
+    if not enabled:
+        yield
+        return
+
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    start_memory = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        peak = tracemalloc.get_traced_memory()[1]
+        if started_tracing:
+            tracemalloc.stop()
+
+        rss = peak_rss_mb()
+        print('Stage %s: %.1f s, peak memory %.1f MB (%.1f MB above the start)%s' % (
+            name, time.perf_counter() - start, peak / 1024.0 / 1024.0, (peak - start_memory) / 1024.0 / 1024.0,
+            '' if rss is None else ', peak process memory %.1f MB' % rss))
@@ -0,0 +1,421 @@
+# This script is used to run the green view index of several cities at the same time and compare them. The cities
+# are listed in a json manifest with their street and boundary layers, the full pipeline (sample points, GSV
+# metadata, green view index and columnar results) runs for every city in its own thread, with one key pool (one
+# rate limit and quota for all cities), one image cache and one classification result cache. The report compares the
+# distributions, the quantiles and the box plots of the cities, computed from the columnar results.
+#
+# Example manifest, the relative paths are relative to the manifest folder:
+#     {"greenmonth": ["05", "06", "07", "08", "09"], "mini_dist": 20,
+#      "cities": [{"name": "Santa Ana", "streets": "SA/streets.shp", "boundary": "SA/boundary.shp", "folder": "SA"},
+#                 {"name": "Long Beach", "streets": "LB/streets.shp", "folder": "LB"}]}
+
+import json
+import os
+
+import numpy
+
+# the quantiles of the report, in percent
+QUANTILES = (0, 5, 25, 50, 75, 95, 100)
+
+
+def read_manifest(manifest_file):
+    """
+    Read the cities of the manifest, the settings at the top level of the manifest are the defaults of the cities
+
+    Return:
+        list of the dictionaries of the cities, with name, streets, boundary (None for no clipping), folder (the
+        output folder), metadata (the folder of the GSV metadata txt files, default folder/metadata, the complete
+        metadata is not collected again, see metadata_complete), greenmonth, mini_dist and num
+    """
+
+    with open(manifest_file, 'r') as manifest:
+        settings = json.load(manifest)
+
+    root = os.path.dirname(os.path.abspath(manifest_file))
+    defaults = {'boundary': None, 'greenmonth': ['05', '06', '07', '08', '09'], 'mini_dist': 20, 'num': 1000}
+    defaults.update((key, value) for key, value in settings.items() if key != 'cities')
+
+    cities = []
+    for city_settings in settings['cities']:
+        city = dict(defaults)
+        city.update(city_settings)
+        city.setdefault('folder', city['name'].replace(' ', '_'))
+        city.setdefault('metadata', os.path.join(city['folder'], 'metadata'))
+
+        for key in ['streets', 'boundary', 'folder', 'metadata']:
+            if city.get(key) is not None:
+                city[key] = os.path.join(root, city[key])
+
+        cities.append(city)
+
+    return cities
+
+
+def clip_points(points_shp, boundary_shp, out_shp):
+    """
+    Keep the sample points inside the city boundary, both layers in WGS84
+
+    Return:
+        the number of the points inside the boundary
+    """
+
+    import fiona
+    from shapely import contains_xy
+    from shapely.geometry import shape
+    from shapely.ops import unary_union
+
+    with fiona.open(boundary_shp, 'r') as boundaries:
+        boundary = unary_union([shape(feature['geometry']) for feature in boundaries])
+
+    num = 0
+    with fiona.open(points_shp, 'r') as points, fiona.open(out_shp, 'w', **points.meta) as clipped:
+        for point in points:
+            lon, lat = point['geometry']['coordinates'][:2]
+            if contains_xy(boundary, lon, lat):
+                clipped.write(point)
+                num += 1
+
+    return num
+
+
+def metadata_complete(metadata_folder, points_shp, num):
+    """
+    Whether the metadata folder has the txt files of all batches of num points of the sample points, the txt file of
+    a batch is only written when the batch is complete (see metadataCollector). Without the sample points, e.g. for
+    the metadata collected before, the metadata folder is complete if it has txt files
+    """
+
+    import math
+
+    import fiona
+
+    if not os.path.isdir(metadata_folder):
+        return False
+
+    if not os.path.exists(points_shp):
+        return any(name.endswith('.txt') for name in os.listdir(metadata_folder))
+
+    with fiona.open(points_shp, 'r') as points:
+        num_points = len(points)
+
+    for b in range(int(math.ceil(num_points / float(num)))):
+        batch_file = 'Pnt_start%s_end%s.txt' % (b * num, min((b + 1) * num, num_points))
+        if not os.path.exists(os.path.join(metadata_folder, batch_file)):
+            return False
+
+    return True
+
+
+def write_city_columns(gvi_folder, npz_file):
+    """
+    Save the GV_ txt results of the city as columns, see Greenview2Shp.write_gvi_columnar
+    """
+
+    if __package__:
+        from .Greenview2Shp import read_gvi_res, write_gvi_columnar
+    else:
+        from Greenview2Shp import read_gvi_res, write_gvi_columnar
+
+    pano_id_lst, pano_date_lst, lon_lst, lat_lst, green_view_lst = read_gvi_res(gvi_folder)
+    write_gvi_columnar(npz_file, pano_id_lst, pano_date_lst, lon_lst, lat_lst, green_view_lst)
+
+
+def run_city(city, provider, key_pool, result_cache=None, classify_pool=None, ring_classifier=None, **gvi_kwargs):
+    """
+    Run the full pipeline for the city, the stages whose output exists are not run again, the metadata collection
+    goes on with the batches which are missing
+
+    Return:
+        the npz file of the columnar results of the city
+
+    Parameters:
+        city: the city from read_manifest
+        provider, key_pool, result_cache, classify_pool, ring_classifier, gvi_kwargs: see
+        GreenView_Calculate.green_view_computing_ogr_6horizon
+    """
+
+    if __package__:
+        from .GreenView_Calculate import green_view_computing_ogr_6horizon
+    else:
+        from GreenView_Calculate import green_view_computing_ogr_6horizon
+
+    name = city['name']
+    folder = city['folder']
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    points_shp = os.path.join(folder, 'points.shp')
+    sample_shp = points_shp
+    if city['boundary'] is not None:
+        sample_shp = os.path.join(folder, 'points_clipped.shp')
+
+    if not metadata_complete(city['metadata'], sample_shp, city['num']):
+        if __package__:
+            from . import createPoints
+            from . import metadataCollector
+        else:
+            import createPoints
+            import metadataCollector
+
+        if not os.path.exists(sample_shp):
+            print('%s: creating the sample points' % name)
+            createPoints.create_points(city['streets'], points_shp, city['mini_dist'])
+
+            if city['boundary'] is not None:
+                print('%s: %d sample points inside the boundary' % (name, clip_points(points_shp, city['boundary'],
+                                                                                     sample_shp)))
+
+        print('%s: collecting the GSV metadata' % name)
+        metadataCollector.gsv_pano_metadata_collector(sample_shp, city['num'], city['metadata'], provider=provider,
+                                                      key_pool=key_pool)
+
+    print('%s: computing the green view index' % name)
+    gvi_folder = os.path.join(folder, 'GVI_values')
+    green_view_computing_ogr_6horizon(city['metadata'], gvi_folder, city['greenmonth'], None, provider=provider,
+                                      key_pool=key_pool, result_cache=result_cache, classify_pool=classify_pool,
+                                      ring_classifier=ring_classifier, **gvi_kwargs)
+
+    npz_file = os.path.join(folder, 'GVI_columns.npz')
+    write_city_columns(gvi_folder, npz_file)
+    print('%s: done' % name)
+
+    return npz_file
+
+
+def run_cities(manifest_file, report_file, key_file=None, provider=None, key_pool=None, cache_folder=None,
+               result_cache_file=None, max_cities=None, **gvi_kwargs):
+    """
+    Run the pipeline for all cities of the manifest concurrently and write the consolidated report
+
+    Return:
+        the report, see consolidated_report
+
+    Parameters:
+        manifest_file: the json manifest of the cities, see read_manifest
+        report_file: the output json report
+        key_file, key_pool: the API keys, one KeyPool is shared by all cities
+        provider: the provider of the GSV images and metadata, the default is GSVProvider.GoogleProvider()
+        cache_folder: the folder of the image cache shared by all cities (see GSVProvider.CachedProvider), None to
+        not cache the images
+        result_cache_file: the SQLite file of the classification results shared by all cities (see ResultCache),
+        None to not cache the results
+        max_cities: the number of the cities processed at the same time, the default is all cities
+        gvi_kwargs: the options of GreenView_Calculate.green_view_computing_ogr_6horizon, e.g. working_size, the
+        classification processes of classify_workers (and shared_memory_slots) are shared by all cities
+    """
+
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+    if __package__:
+        from . import GSVProvider
+        from . import KeyPool
+    else:
+        import GSVProvider
+        import KeyPool
+
+    cities = read_manifest(manifest_file)
+
+    if provider is None:
+        provider = GSVProvider.GoogleProvider()
+    if cache_folder is not None:
+        provider = GSVProvider.CachedProvider(provider, cache_folder)
+    if key_pool is None:
+        key_pool = KeyPool.KeyPool.from_file(key_file, min_interval=0.01)
+
+    result_cache = None
+    if result_cache_file is not None:
+        if __package__:
+            from . import ResultCache
+            from .GreenView_Calculate import classifier_fingerprint
+        else:
+            import ResultCache
+            from GreenView_Calculate import classifier_fingerprint
+
+        # the views cut from the panoramas are classified at their size, whatever the working_size
+        working_size = gvi_kwargs.get('working_size') if gvi_kwargs.get('panorama_zoom') is None else None
+        fingerprint = classifier_fingerprint(working_size, gvi_kwargs.get('lut_bits'))
+        result_cache = ResultCache.ResultCache(result_cache_file, fingerprint)
+
+    # one set of classification processes for all cities, instead of classify_workers processes for every city
+    classify_pool = None
+    ring_classifier = None
+    classify_workers = gvi_kwargs.get('classify_workers')
+    if classify_workers is not None and gvi_kwargs.get('shared_memory_slots') is not None:
+        if __package__:
+            from . import ImageRing
+        else:
+            import ImageRing
+        ring_classifier = ImageRing.RingClassifier(classify_workers, gvi_kwargs['shared_memory_slots'],
+                                                   gvi_kwargs.get('working_size') or 400,
+                                                   lut_bits=gvi_kwargs.get('lut_bits'))
+    elif classify_workers is not None:
+        classify_pool = ProcessPoolExecutor(classify_workers)
+
+    city_results = {}
+    failed = {}
+    try:
+        with ThreadPoolExecutor(max_cities or len(cities)) as city_pool:
+            futures = [(city['name'], city_pool.submit(run_city, city, provider, key_pool, result_cache, classify_pool,
+                                                       ring_classifier, **gvi_kwargs))
+                       for city in cities]
+
+            for name, future in futures:
+                try:
+                    city_results[name] = future.result()
+                except Exception as error:
+                    print('%s failed: %r' % (name, error))
+                    failed[name] = repr(error)
+    finally:
+        if classify_pool is not None:
+            classify_pool.shutdown()
+        if ring_classifier is not None:
+            ring_classifier.shutdown()
+
+    key_pool.save()
+    if result_cache is not None:
+        result_cache.close()
+
+    report = consolidated_report(city_results)
+    report['failed'] = failed
+    if report_file is not None:
+        save_report(report, report_file)
+
+    return report
+
+
+def gvi_summary(green_view, bin_width=5):
+    """
+    The statistics of the green view index of one city
+
+    Return:
+        dictionary of count, mean, std, the quantiles, the histogram (bins of bin_width from 0 to 100) and the box
+        plot data (q1, med, q3, the whiskers at 1.5 interquartile ranges and the fliers beyond them, in the format of
+        matplotlib bxp)
+    """
+
+    values = numpy.asarray(green_view, dtype=float)
+    values = values[values >= 0]
+
+    if len(values) == 0:
+        return {'count': 0}
+
+    quantiles = numpy.percentile(values, QUANTILES)
+    q1, med, q3 = numpy.percentile(values, [25, 50, 75])
+    iqr = q3 - q1
+    whislo = values[values >= q1 - 1.5 * iqr].min()
+    whishi = values[values <= q3 + 1.5 * iqr].max()
+    fliers = values[(values < whislo) | (values > whishi)]
+    counts, edges = numpy.histogram(values, numpy.arange(0, 100 + bin_width, bin_width))
+
+    return {'count': int(len(values)),
+            'mean': float(values.mean()),
+            'std': float(values.std()),
+            'quantiles': {'p%d' % q: float(value) for q, value in zip(QUANTILES, quantiles)},
+            'histogram': {'edges': edges.tolist(), 'counts': counts.tolist()},
+            'boxplot': {'q1': float(q1), 'med': float(med), 'q3': float(q3), 'whislo': float(whislo),
+                        'whishi': float(whishi), 'mean': float(values.mean()), 'fliers': fliers.tolist()}}
+
+
+def consolidated_report(city_results, report_file=None):
+    """
+    Compare the green view index of the cities
+
+    Return:
+        dictionary with the gvi_summary of every city in cities
+
+    Parameters:
+        city_results: dictionary of the city name and the npz file of its columnar results
+        report_file: the output json report, None to not save the report
+    """
+
+    if __package__:
+        from .Greenview2Shp import read_gvi_columnar
+    else:
+        from Greenview2Shp import read_gvi_columnar
+
+    report = {'quantiles': list(QUANTILES), 'cities': {}}
+    for name in city_results:
+        report['cities'][name] = gvi_summary(read_gvi_columnar(city_results[name])['greenView'])
+
+    print('%-25s %8s %8s %8s %8s %8s' % ('city', 'points', 'mean', 'p25', 'median', 'p75'))
+    for name, summary in report['cities'].items():
+        if summary['count'] == 0:
+            print('%-25s %8d' % (name, 0))
+            continue
+        quantiles = summary['quantiles']
+        print('%-25s %8d %8.2f %8.2f %8.2f %8.2f' % (name, summary['count'], summary['mean'], quantiles['p25'],
+                                                     quantiles['p50'], quantiles['p75']))
+
+    if report_file is not None:
+        save_report(report, report_file)
+
+    return report
+
+
+def save_report(report, report_file):
+    with open(report_file, 'w') as out:
+        json.dump(report, out, indent=2)
+
+
+def report_from_manifest(manifest_file, report_file=None):
+    """
+    The consolidated report of the cities of the manifest which have their results already, the GV_ txt results are
+    converted to columns once
+    """
+
+    city_results = {}
+    for city in read_manifest(manifest_file):
+        npz_file = os.path.join(city['folder'], 'GVI_columns.npz')
+        if not os.path.exists(npz_file):
+            gvi_folder = os.path.join(city['folder'], 'GVI_values')
+            if not os.path.exists(gvi_folder):
+                print('%s has no results' % city['name'])
+                continue
+            write_city_columns(gvi_folder, npz_file)
+        city_results[city['name']] = npz_file
+
+    return consolidated_report(city_results, report_file)
+
+
+def plot_report(report, out_png=None):
+    """
+    Plot the box plots and the histograms of the cities of the report, show the plot or save it to out_png
+    """
+
+    import matplotlib.pyplot as plt
+
+    names = [name for name, summary in report['cities'].items() if summary['count'] > 0]
+    fig, (box_ax, hist_ax) = plt.subplots(nrows=2, ncols=1, figsize=(8, 8))
+
+    stats = [dict(report['cities'][name]['boxplot'], label=name) for name in names]
+    # orientation replaced vert in matplotlib 3.10
+    try:
+        box_ax.bxp(stats, orientation='horizontal', showmeans=True)
+    except TypeError:
+        box_ax.bxp(stats, vert=False, showmeans=True)
+    box_ax.set_xlabel('green view index')
+
+    for name in names:
+        histogram = report['cities'][name]['histogram']
+        counts = numpy.array(histogram['counts'], dtype=float)
+        hist_ax.step(histogram['edges'][:-1], counts / counts.sum(), where='post', label=name)
+    hist_ax.set_xlabel('green view index')
+    hist_ax.set_ylabel('share of the points')
+    hist_ax.legend()
+
+    if out_png is None:
+        plt.show()
+    else:
+        fig.savefig(out_png)
+    plt.close(fig)
+
+
+# ------------Main Function -------------------
+if __name__ == "__main__":
+    import sys
+
+    # python MultiCity.py cities.json
+    manifest = sys.argv[1] if len(sys.argv) > 1 else 'cities.json'
+    city_report = run_cities(manifest, 'cities_report.json', 'keys.txt', cache_folder='image_cache',
+                             result_cache_file='gvi_results.sqlite', max_cities=4)
+    plot_report(city_report, 'cities_report.png')
@@ -0,0 +1,182 @@
+# This script is used to calculate the green view index from one equirectangular panorama per pano_id, instead
+# of six separate GSV images. The panorama is stitched from the tiles of the cbk service, then the perspective
+# views at the headings are cut locally with a remapping table, which only depends on the panorama size and the
+# views, so it is computed once for every panorama size and shared by the panoramas of this size.
+
+from io import BytesIO
+
+import numpy
+from PIL import Image
+
+
+def build_view_table(pano_width, pano_height, headings, pitch=0, view_size=400, fov=60):
+    """
+    Compute the remapping table from the equirectangular panorama to the perspective views, each pixel of the
+    views takes the nearest pixel of the panorama. The column 0 of the panorama is at heading -180 and the
+    middle column at heading 0 (the direction of the panorama), the row 0 is at pitch 90
+
+    Return:
+        rows, cols: integer arrays of the shape (number of headings, view_size, view_size) with the panorama row
+        and column of every view pixel
+
+    Parameters:
+        pano_width, pano_height: the size of the equirectangular panorama
+        headings: the headings of the views in degree
+        pitch: the pitch of the views in degree
+        view_size: the width and height of the views in pixel
+        fov: the horizontal (and vertical) field of view of the views in degree
+    """
+
+    focal = (view_size / 2.0) / numpy.tan(numpy.radians(fov) / 2.0)
+    coords = numpy.arange(view_size) - view_size / 2.0 + 0.5
+    x, y = numpy.meshgrid(coords, -coords)
+    z = numpy.full(x.shape, focal)
+
+    # rotate the rays of the camera by the pitch around the horizontal axis
+    pitch_rad = numpy.radians(pitch)
+    y_rot = y * numpy.cos(pitch_rad) + z * numpy.sin(pitch_rad)
+    z_rot = -y * numpy.sin(pitch_rad) + z * numpy.cos(pitch_rad)
+
+    lat = numpy.arctan2(y_rot, numpy.sqrt(x * x + z_rot * z_rot))
+    lon_offset = numpy.arctan2(x, z_rot)
+
+    rows = numpy.empty((len(headings), view_size, view_size), dtype=numpy.int32)
+    cols = numpy.empty((len(headings), view_size, view_size), dtype=numpy.int32)
+
+    for idx, heading in enumerate(headings):
+        lon = numpy.radians(heading) + lon_offset
+        col = (lon / (2 * numpy.pi) + 0.5) * pano_width
+        row = (0.5 - lat / numpy.pi) * pano_height
+
+        cols[idx] = numpy.floor(col).astype(numpy.int64) % pano_width
+        rows[idx] = numpy.clip(numpy.floor(row), 0, pano_height - 1)
+
+    return rows, cols
+
+
+def cut_views(pano, table, pano_yaw=0):
+    """
+    Cut the perspective views from the panorama with one fancy index
+
+    Return:
+        numpy array of the shape (number of headings, view_size, view_size, 3)
+
+    Parameters:
+        pano: the equirectangular panorama as numpy array
+        table: the remapping table from build_view_table, for the same panorama size
+        pano_yaw: the compass heading of the middle column of the panorama, with 0 the view headings are relative
+        to the direction of the panorama
+    """
+
+    rows, cols = table
+    pano_width = pano.shape[1]
+    shift = int(round(pano_yaw / 360.0 * pano_width))
+
+    if shift != 0:
+        cols = (cols - shift) % pano_width
+
+    return pano[rows, cols]
+
+
+def panorama_size(image_width, image_height, zoom, tile_size=512):
+    """
+    The size of the panorama at the zoom level. The metadata gives the size of the panorama at the highest zoom
+    level, the first zoom level where the tiles cover the image_width, the tiles beyond the panorama are black, e.g.
+    a panorama of 13312 x 6656 is 1664 x 832 at zoom 2, in a grid of tiles of 2048 x 1024
+
+    Return:
+        pano_width, pano_height
+    """
+
+    max_zoom = max(int(numpy.ceil(numpy.log2(image_width / float(tile_size)))), 0)
+    scale = 2.0 ** (zoom - max_zoom)
+
+    return int(round(image_width * scale)), int(round(image_height * scale))
+
+
+def tile_rows_needed(table, tile_size=512):
+    """
+    The rows of the tiles covered by the views, the other tile rows do not need to be downloaded
+    """
+
+    rows = table[0]
+    return range(int(rows.min()) // tile_size, int(rows.max()) // tile_size + 1)
+
+
+def fetch_panorama(pano_id, provider, key_pool, zoom=2, tile_size=512, tile_rows=None, pano_size=None):
+    """
+    Download the tiles of the equirectangular panorama and stitch them. At the zoom level the tiles are
+    tile_size * 2 ** zoom wide and half of it high, the panorama is cropped to its size at the zoom level
+
+    Return:
+        numpy array of the panorama, the rows of the tiles which were not downloaded are black
+
+    Parameters:
+        pano_id: the id of the panorama
+        provider: the provider of the tiles (see GSVProvider)
+        key_pool: the KeyPool used for the requests, the tiles are not counted to the image quota
+        zoom: the zoom level of the panorama
+        tile_size: the size of the tiles
+        tile_rows: the rows of the tiles to download (see tile_rows_needed), the default is all rows
+        pano_size: the width and height of the panorama at the zoom level (see panorama_size), the default is the
+        size of the tiles
+    """
+
+    if __package__:
+        from . import GSVProvider
+    else:
+        import GSVProvider
+
+    num_x = 2 ** zoom
+    num_y = max(2 ** (zoom - 1), 1)
+    if tile_rows is None:
+        tile_rows = range(num_y)
+
+    pano = numpy.zeros((num_y * tile_size, num_x * tile_size, 3), dtype=numpy.uint8)
+
+    for y in tile_rows:
+        for x in range(num_x):
+            response = GSVProvider.request_tile(provider, key_pool, pano_id, zoom, x, y)
+            tile = Image.open(BytesIO(response.content)).convert('RGB')
+            pano[y * tile_size:(y + 1) * tile_size, x * tile_size:(x + 1) * tile_size] = \
+                numpy.asarray(tile)[:tile_size, :tile_size]
+
+    if pano_size is not None:
+        pano = pano[:pano_size[1], :pano_size[0]]
+
+    return pano
+
+
+def panorama_green_view(pano_id, provider, key_pool, headings, table, zoom=2, tile_size=512, pano_yaw=0,
+                        result_cache=None, lut_bits=None, pano_size=None):
+    """
+    Calculate the green view index of the panorama from the views cut from the equirectangular panorama
+
+    Return:
+        green_view_val, profile: the green view index and the dictionary of the heading and the green percent
+
+    Parameters:
+        pano_id: the id of the panorama
+        provider, key_pool: see fetch_panorama
+        headings: the headings of the views, in the order of the table
+        table: the remapping table from build_view_table for the panorama size at the zoom level
+        zoom, tile_size, pano_size: see fetch_panorama
+        pano_yaw: see cut_views
+        result_cache: the ResultCache of the classification results of the views, keyed by the hash of the view pixels
+        lut_bits: see GreenView_Calculate.vegetation_classification
+    """
+
+    if __package__:
+        from .GreenView_Calculate import classify_cached
+    else:
+        from GreenView_Calculate import classify_cached
+
+    pano = fetch_panorama(pano_id, provider, key_pool, zoom, tile_size, tile_rows_needed(table, tile_size), pano_size)
+    views = cut_views(pano, table, pano_yaw)
+
+    # classify the views as a batch
+    profile = {}
+    for heading, view in zip(headings, views):
+        profile[heading] = classify_cached(view, result_cache=result_cache, lut_bits=lut_bits)
+
+    return numpy.mean(list(profile.values())), profile
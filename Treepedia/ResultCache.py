@@ -0,0 +1,139 @@
+# This script is used to cache the classification results of the GSV images. The green percent of every image
+# (and optionally the compressed green mask) is stored in a SQLite database, keyed by the hash of the image and
+# the fingerprint of the classifier parameters, so a rerun with the same parameters does not segment the images
+# again, and after a parameter change only the images are classified again.
+
+import hashlib
+import json
+import sqlite3
+import threading
+import zlib
+
+import numpy
+
+
+def image_hash(content):
+    """
+    The hash of the image bytes (or of the pixels of a numpy array) used as the key of the cache
+    """
+
+    if isinstance(content, numpy.ndarray):
+        content = numpy.ascontiguousarray(content).tobytes()
+
+    return hashlib.sha1(content).hexdigest()
+
+
+def parameter_fingerprint(params):
+    """
+    The fingerprint of the classifier parameters, the same parameters always give the same fingerprint
+
+    Parameters:
+        params: dictionary of the parameters of the classification, see GreenView_Calculate.classifier_fingerprint
+    """
+
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def pack_mask(mask):
+    """
+    Compress the boolean green mask, 8 pixels per byte and zlib
+    """
+
+    return zlib.compress(numpy.packbits(mask.astype(bool)).tobytes())
+
+
+def unpack_mask(blob, shape):
+    """
+    Decompress the green mask compressed by pack_mask
+    """
+
+    bits = numpy.frombuffer(zlib.decompress(blob), dtype=numpy.uint8)
+    return numpy.unpackbits(bits)[:shape[0] * shape[1]].reshape(shape).astype(bool)
+
+
+class ResultCache:
+    """
+    The cache of the classification results, several threads can use one cache and several processes can use the
+    same database file
+
+    Parameters:
+        db_file: the SQLite database file
+        fingerprint: the fingerprint of the classifier parameters of this run, see parameter_fingerprint
+        store_masks: also store the compressed green masks
+        commit_every: the number of stored results after which they are committed
+    """
+
+    def __init__(self, db_file, fingerprint, store_masks=False, commit_every=100):
+        self.db_file = db_file
+        self.fingerprint = fingerprint
+        self.store_masks = store_masks
+        self.commit_every = commit_every
+        self.uncommitted = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(db_file, timeout=60, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS results (image_hash TEXT, fingerprint TEXT, '
+                                'green_percent REAL, height INTEGER, width INTEGER, mask BLOB, '
+                                'PRIMARY KEY (image_hash, fingerprint))')
+        self.connection.commit()
+
+    def lookup(self, key):
+        """
+        The cached green percent of the image with the hash key, None if it is not in the cache
+        """
+
+        with self.lock:
+            row = self.connection.execute('SELECT green_percent FROM results WHERE image_hash = ? AND fingerprint = ?',
+                                          (key, self.fingerprint)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            return row[0]
+
+    def lookup_mask(self, key):
+        """
+        The cached green mask of the image with the hash key, None if it is not in the cache
+        """
+
+        with self.lock:
+            row = self.connection.execute('SELECT height, width, mask FROM results WHERE image_hash = ? AND '
+                                          'fingerprint = ?', (key, self.fingerprint)).fetchone()
+
+        if row is None or row[2] is None:
+            return None
+
+        return unpack_mask(row[2], (row[0], row[1]))
+
+    def store(self, key, green_percent, mask=None):
+        """
+        Store the green percent (and the green mask if store_masks) of the image with the hash key
+        """
+
+        height, width, blob = None, None, None
+        if self.store_masks and mask is not None:
+            height, width = mask.shape
+            blob = pack_mask(mask)
+
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                                    (key, self.fingerprint, float(green_percent), height, width, blob))
+            self.uncommitted += 1
+            if self.uncommitted >= self.commit_every:
+                self.connection.commit()
+                self.uncommitted = 0
+
+    def close(self):
+        """
+        Commit the stored results and close the database
+        """
+
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+        print('Result cache: %d hits, %d misses' % (self.hits, self.misses))
@@ -1,9 +1,14 @@
-import matplotlib.pyplot as plt
 import skimage.color as color
 import skimage.segmentation as seg
 
+# the parameters of the felzenszwalb segmentation, they are part of the fingerprint of the classification results
+SEGMENTATION_PARAMS = {'scale': 1, 'sigma': 0.8, 'min_size': 20}
+
 
 def image_show(image, nrows=1, ncols=1, cmap='gray'):
+    # matplotlib is only imported for debugging, it is slow to import in every worker process
+    import matplotlib.pyplot as plt
+
     fig, ax = plt.subplots(nrows=nrows, ncols=ncols, figsize=(8, 8))
     ax.imshow(image, cmap)
     ax.axis('off')
@@ -18,7 +23,7 @@ def segment(image):
     # plt.close()
     # image_slic = seg.slic(image,n_segments=500)
 
-    image_felzenszwalb = seg.felzenszwalb(image)
+    image_felzenszwalb = seg.felzenszwalb(image, **SEGMENTATION_PARAMS)
     image_felzenszwalb_colored = color.label2rgb(image_felzenszwalb, image, kind='avg')
     # image_show(image_felzenszwalb_colored);
 
@@ -0,0 +1,236 @@
+# This script is used to compute the green view index through time. The cbk metadata service returns one panorama
+# per location, so the history of the panoramas of every sample point is built by merging the metadata of several
+# runs (e.g. the runs of the incremental refresh). A selector chooses the best panorama of each point for the
+# target season of every year, and the time series of the green view index is computed in one run, with the
+# images cached on disk, so each image of a panorama is only downloaded once.
+#
+# Limitation: metadataCollector only records the current panorama of every point, the older panoramas are not
+# requested. The history therefore only has the panoramas seen by the metadata runs which were kept, a time series
+# needs metadata collected over several years (or seasons), a single run gives a single year.
+
+import os
+
+import numpy
+
+
+def read_metadata_history(metadata_folders):
+    """
+    Merge the GSV metadata txt files of several runs into the history of the panoramas of every sample point
+
+    Return:
+        dictionary of the pointID and the list of the (pano_id, pano_date, lon, lat) of all different panoramas
+        found for the sample point
+
+    Parameters:
+        metadata_folders: list of the folders of the GSV metadata txt files, with pointID (see metadataCollector)
+    """
+
+    if __package__:
+        from .metadataCollector import parse_metadata_line
+    else:
+        from metadataCollector import parse_metadata_line
+
+    history = {}
+
+    for metadata_folder in metadata_folders:
+        for txt_file in os.listdir(metadata_folder):
+            if not txt_file.endswith('.txt'):
+                continue
+
+            with open(os.path.join(metadata_folder, txt_file), 'r') as lines:
+                for line in lines:
+                    if 'pointID:' not in line:
+                        raise ValueError('The metadata in %s has no pointID, collect it again with metadataCollector'
+                                         % txt_file)
+
+                    metadata = parse_metadata_line(line)
+                    candidates = history.setdefault(int(metadata['pointID']), [])
+                    if metadata['panoID'] not in [candidate[0] for candidate in candidates]:
+                        candidates.append((metadata['panoID'], metadata['panoDate'], metadata['longitude'],
+                                           metadata['latitude']))
+
+    return history
+
+
+def season_distance(month, target_months):
+    """
+    The number of months between the month and the closest month of the target season, across the new year
+    """
+
+    month = int(month)
+    return min(min(abs(month - int(target)), 12 - abs(month - int(target))) for target in target_months)
+
+
+def select_panorama(candidates, target_months, year=None, max_month_distance=0):
+    """
+    Select the best panorama of a sample point for the target season, the panorama closest to the season, and the
+    latest one of those
+
+    Return:
+        the selected (pano_id, pano_date, lon, lat), or None if no panorama is close enough to the season
+
+    Parameters:
+        candidates: the list of the (pano_id, pano_date, lon, lat) of the sample point
+        target_months: the months of the season, e.g. ['05', '06', '07', '08', '09']
+        year: only select the panoramas of this year, None for all years
+        max_month_distance: the panoramas up to this number of months outside of the season are also accepted
+    """
+
+    best = None
+    best_rank = None
+
+    for candidate in candidates:
+        pano_date = candidate[1]
+        if year is not None and pano_date[:4] != str(year):
+            continue
+
+        distance = season_distance(pano_date[-2:], target_months)
+        if distance > max_month_distance:
+            continue
+
+        # the closest to the season first, then the latest date
+        rank = (-distance, pano_date)
+        if best_rank is None or rank > best_rank:
+            best = candidate
+            best_rank = rank
+
+    return best
+
+
+def select_panoramas(history, target_months, year=None, max_month_distance=0):
+    """
+    Select the best panorama of every sample point of the history for the target season, see select_panorama
+
+    Return:
+        dictionary of the pointID and the selected (pano_id, pano_date, lon, lat)
+    """
+
+    selected = {}
+    for point_id, candidates in history.items():
+        candidate = select_panorama(candidates, target_months, year, max_month_distance)
+        if candidate is not None:
+            selected[point_id] = candidate
+
+    return selected
+
+
+def green_view_time_series(metadata_folders, out_npz, target_months, years, key_file=None, provider=None,
+                           key_pool=None, cache_folder=None, max_month_distance=0, working_size=None):
+    """
+    Compute the green view index of every sample point for every year, with the best panorama of the year for the
+    target season, and save it as columns in a npz file (see Greenview2Shp.write_gvi_columnar) with the extra
+    columns pointID and year. A panorama selected for several years or points is only computed once.
+
+    Return:
+        the columns of the time series, see Greenview2Shp.read_gvi_columnar
+
+    Parameters:
+        metadata_folders: the folders of the GSV metadata txt files of several runs, see read_metadata_history
+        out_npz: the output npz file
+        target_months: the months of the season, e.g. ['05', '06', '07', '08', '09']
+        years: the list of the years of the time series
+        key_file, key_pool: the API keys, see green_view_computing_ogr_6horizon
+        provider: the provider of the GSV images, the default is GSVProvider.GoogleProvider()
+        cache_folder: the folder of the image cache (see GSVProvider.CachedProvider), None to not cache the images
+        max_month_distance: see select_panorama
+        working_size: see GreenView_Calculate.decode_image
+    """
+
+    if __package__:
+        from . import GSVProvider
+        from . import KeyPool
+        from .GreenView_Calculate import pano_green_view
+        from .Greenview2Shp import write_gvi_columnar, read_gvi_columnar
+    else:
+        import GSVProvider
+        import KeyPool
+        from GreenView_Calculate import pano_green_view
+        from Greenview2Shp import write_gvi_columnar, read_gvi_columnar
+
+    if provider is None:
+        provider = GSVProvider.GoogleProvider()
+    if cache_folder is not None:
+        provider = GSVProvider.CachedProvider(provider, cache_folder)
+    if key_pool is None:
+        key_pool = KeyPool.KeyPool.from_file(key_file, min_interval=0.01)
+
+    heading_arr = 360 / 6 * numpy.array([0, 1, 2, 3, 4, 5])
+    pitch = 0
+
+    history = read_metadata_history(metadata_folders)
+    pano_gvi = {}
+    columns = {'pano_id': [], 'pano_date': [], 'lon': [], 'lat': [], 'green_view': [], 'point_id': [], 'year': []}
+
+    for year in years:
+        selected = select_panoramas(history, target_months, year, max_month_distance)
+        print('Year %s: %d of %d sample points have a panorama in the season' % (year, len(selected), len(history)))
+
+        for point_id in sorted(selected):
+            pano_id, pano_date, lon, lat = selected[point_id]
+
+            if pano_id not in pano_gvi:
+                try:
+                    pano_gvi[pano_id] = pano_green_view(pano_id, heading_arr, pitch, provider, key_pool,
+                                                        working_size)[0]
+                except KeyPool.KeysRejected:
+                    raise
+                # if the GSV images are not download successfully or failed to run, then return a null value
+                except:
+                    print('SOMETHING UNEXPECTED JUST HAPPENED')
+                    pano_gvi[pano_id] = -1000 / float(len(heading_arr))
+
+            columns['pano_id'].append(pano_id)
+            columns['pano_date'].append(pano_date)
+            columns['lon'].append(lon)
+            columns['lat'].append(lat)
+            columns['green_view'].append(pano_gvi[pano_id])
+            columns['point_id'].append(point_id)
+            columns['year'].append(int(year))
+
+    key_pool.save()
+    print('Computed %d panoramas for %d values of the time series' % (len(pano_gvi), len(columns['pano_id'])))
+
+    write_gvi_columnar(out_npz, columns['pano_id'], columns['pano_date'], columns['lon'], columns['lat'],
+                       columns['green_view'], pointID=numpy.array(columns['point_id'], dtype=int),
+                       year=numpy.array(columns['year'], dtype=int))
+
+    return read_gvi_columnar(out_npz)
+
+
+def compare_years(columns, year_a, year_b):
+    """
+    Compare the green view index of the sample points between two years of the time series, the points without
+    valid green view index in both years are left out
+
+    Return:
+        point_ids, gvi_a, gvi_b, diff: numpy arrays of the common sample points, their green view index in both
+        years and the change from year_a to year_b
+
+    Parameters:
+        columns: the columns of the time series, see green_view_time_series
+        year_a, year_b: the years to compare
+    """
+
+    valid = columns['greenView'] >= 0
+    in_a = valid & (columns['year'] == int(year_a))
+    in_b = valid & (columns['year'] == int(year_b))
+
+    point_ids, idx_a, idx_b = numpy.intersect1d(columns['pointID'][in_a], columns['pointID'][in_b],
+                                                return_indices=True)
+    gvi_a = columns['greenView'][in_a][idx_a]
+    gvi_b = columns['greenView'][in_b][idx_b]
+
+    return point_ids, gvi_a, gvi_b, gvi_b - gvi_a
+
+
+# ------------Main Function -------------------
+if __name__ == "__main__":
+    root = '..\\kastela'
+    metadata_runs = [os.path.join(root, 'metadata'), os.path.join(root, 'metadata_refresh')]
+    greenmonth = ['05', '06', '07', '08', '09']
+
+    time_series = green_view_time_series(metadata_runs, os.path.join(root, 'GVI_time_series.npz'), greenmonth,
+                                         [2011, 2015, 2019], 'keys.txt',
+                                         cache_folder=os.path.join(root, 'image_cache'))
+    point_ids, gvi_2011, gvi_2019, gvi_diff = compare_years(time_series, 2011, 2019)
+    print('Mean change of the green view index 2011 - 2019 of %d points: %.2f' % (len(point_ids), gvi_diff.mean()))
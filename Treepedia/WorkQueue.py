@@ -0,0 +1,447 @@
+# This script is used to compute the green view index with several worker processes at the same time. A coordinator
+# puts the panoramas of the GSV metadata txt files in batches into a SQLite queue, the workers lease a batch, compute
+# the green view index of its panoramas and return the results. A lease expires when the worker does not renew it,
+# e.g. when the worker process is killed, and the batch is given to the next worker. The coordinator writes the
+# results to the usual GV_ txt files at the end. The locking of SQLite is not reliable on network filesystems (NFS,
+# SMB), so the queue file has to be on a local filesystem, the coordinator and the workers run on the same machine.
+
+import os
+import socket
+import sqlite3
+import time
+
+import numpy
+
+
+# the filesystem types of /proc/mounts whose file locks SQLite can not rely on
+NETWORK_FILESYSTEMS = ('nfs', 'nfs4', 'cifs', 'smb', 'smbfs', 'smb3', 'afs', 'ncpfs', 'fuse.sshfs', '9p', 'ceph',
+                       'glusterfs', 'fuse.glusterfs', 'lustre', 'gpfs', 'davfs', 'fuse.davfs2')
+
+
+def is_network_path(path):
+    """
+    Check whether the path is on a network filesystem, a UNC path or a network drive on Windows and a network
+    filesystem of /proc/mounts on Linux. On other systems the path is taken as local
+    """
+
+    path = os.path.abspath(path)
+
+    if os.name == 'nt':
+        import ctypes
+
+        drive = os.path.splitdrive(path)[0]
+        if drive.startswith('\\\\'):
+            return True
+        # DRIVE_REMOTE
+        return ctypes.windll.kernel32.GetDriveTypeW(drive + '\\') == 4
+
+    if not os.path.exists('/proc/mounts'):
+        return False
+
+    path = os.path.realpath(path)
+    mount_point, fs_type = '', None
+    with open('/proc/mounts', 'r') as mounts:
+        for line in mounts:
+            fields = line.split()
+            if len(fields) < 3:
+                continue
+            # the mount points escape the spaces as \040
+            point = fields[1].replace('\\040', ' ')
+            inside = path == point or path.startswith(point.rstrip('/') + '/')
+            if inside and len(point) >= len(mount_point):
+                mount_point, fs_type = point, fields[2]
+
+    return fs_type in NETWORK_FILESYSTEMS
+
+
+def connect(queue_db):
+    """
+    Open the queue database, raise ValueError if the file is on a network filesystem, whose locks are not reliable
+    enough for the transactions of several workers
+    """
+
+    if is_network_path(queue_db):
+        raise ValueError('The queue file %s is on a network filesystem, SQLite can not lock it reliably, put it on '
+                         'a local filesystem and run the workers on the same machine' % queue_db)
+
+    connection = sqlite3.connect(queue_db, timeout=60, isolation_level=None)
+    connection.execute('CREATE TABLE IF NOT EXISTS batches (batch_id INTEGER PRIMARY KEY, state TEXT, worker TEXT, '
+                       'lease_expires REAL, attempts INTEGER, error TEXT)')
+    connection.execute('CREATE TABLE IF NOT EXISTS panoramas (seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+                       'pano_id TEXT UNIQUE, pano_date TEXT, lon TEXT, lat TEXT, txt_file TEXT, batch_id INTEGER, '
+                       'green_view REAL)')
+    connection.execute('CREATE INDEX IF NOT EXISTS panoramas_batch ON panoramas (batch_id)')
+
+    return connection
+
+
+def read_panoramas(gsv_info_folder, greenmonth):
+    """
+    Read the panoramas of the green season from the GSV metadata txt files, in the same way as
+    GreenView_Calculate.green_view_computing_ogr_6horizon, every panorama only once
+
+    Return:
+        list of the (pano_id, pano_date, lon, lat, txt_file) of the panoramas
+    """
+
+    if __package__:
+        from .metadataCollector import parse_metadata_line
+    else:
+        from metadataCollector import parse_metadata_line
+
+    panoramas = []
+    pano_ids = set()
+
+    for txt_file in os.listdir(gsv_info_folder):
+        if not txt_file.endswith('.txt'):
+            continue
+
+        with open(os.path.join(gsv_info_folder, txt_file), 'r') as lines:
+            for line in lines:
+                metadata = parse_metadata_line(line)
+                pano_id = metadata['panoID']
+                pano_date = metadata['panoDate']
+                lon = metadata['longitude']
+                lat = metadata['latitude']
+
+                # in case, the longitude and latitude are invalid
+                if len(lon) < 3 or pano_date[-2:] not in greenmonth or pano_id in pano_ids:
+                    continue
+
+                pano_ids.add(pano_id)
+                panoramas.append((pano_id, pano_date, lon, lat, txt_file))
+
+    return panoramas
+
+
+def create_queue(queue_db, gsv_info_folder, greenmonth, batch_size=50):
+    """
+    Put the panoramas of the GSV metadata txt files into the queue, in batches of batch_size panoramas. The
+    panoramas which are already in the queue are not added again, so the coordinator can be restarted
+
+    Return:
+        the number of the new batches
+    """
+
+    connection = connect(queue_db)
+    known = set(row[0] for row in connection.execute('SELECT pano_id FROM panoramas'))
+    panoramas = [panorama for panorama in read_panoramas(gsv_info_folder, greenmonth) if panorama[0] not in known]
+
+    connection.execute('BEGIN IMMEDIATE')
+    next_batch = connection.execute('SELECT COALESCE(MAX(batch_id), -1) + 1 FROM batches').fetchone()[0]
+    num_batches = 0
+    for start in range(0, len(panoramas), batch_size):
+        batch_id = next_batch + num_batches
+        connection.execute("INSERT INTO batches VALUES (?, 'pending', NULL, NULL, 0, NULL)", (batch_id,))
+        connection.executemany('INSERT INTO panoramas (pano_id, pano_date, lon, lat, txt_file, batch_id) '
+                               'VALUES (?, ?, ?, ?, ?, ?)',
+                               [panorama + (batch_id,) for panorama in panoramas[start:start + batch_size]])
+        num_batches += 1
+    connection.execute('COMMIT')
+    connection.close()
+
+    print('Added %d panoramas in %d batches to the queue' % (len(panoramas), num_batches))
+    return num_batches
+
+
+class WorkQueue:
+    """
+    The worker side of the queue, see create_queue
+
+    Parameters:
+        queue_db: the SQLite file of the queue
+        lease_seconds: the batch is given to another worker when the lease is not renewed or completed within
+        this time
+        max_attempts: a batch which failed (or whose lease expired) max_attempts times is not given out any more
+    """
+
+    def __init__(self, queue_db, lease_seconds=600, max_attempts=3):
+        self.queue_db = queue_db
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.connection = connect(queue_db)
+
+    def requeue_expired(self):
+        """
+        Give the batches with expired leases back to the queue, or mark them failed after max_attempts, this has
+        to be called in a transaction
+        """
+
+        now = time.time()
+        self.connection.execute("UPDATE batches SET state = 'failed', worker = NULL, error = 'lease expired' "
+                                "WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?",
+                                (now, self.max_attempts))
+        self.connection.execute("UPDATE batches SET state = 'pending', worker = NULL, error = 'lease expired' "
+                                "WHERE state = 'leased' AND lease_expires < ?", (now,))
+
+    def lease(self, worker):
+        """
+        Lease the next pending batch
+
+        Return:
+            batch_id, panoramas: the id of the batch and the list of its (pano_id, pano_date, lon, lat), or None if
+            there is no pending batch
+        """
+
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            self.requeue_expired()
+            row = self.connection.execute("SELECT batch_id FROM batches WHERE state = 'pending' "
+                                          "ORDER BY batch_id LIMIT 1").fetchone()
+            if row is None:
+                self.connection.execute('COMMIT')
+                return None
+
+            batch_id = row[0]
+            self.connection.execute("UPDATE batches SET state = 'leased', worker = ?, lease_expires = ?, "
+                                    "attempts = attempts + 1 WHERE batch_id = ?",
+                                    (worker, time.time() + self.lease_seconds, batch_id))
+            panoramas = self.connection.execute('SELECT pano_id, pano_date, lon, lat FROM panoramas '
+                                                'WHERE batch_id = ? ORDER BY seq', (batch_id,)).fetchall()
+            self.connection.execute('COMMIT')
+        except:
+            self.connection.execute('ROLLBACK')
+            raise
+
+        return batch_id, panoramas
+
+    def renew(self, batch_id, worker):
+        """
+        Extend the lease of the batch
+
+        Return:
+            False if the lease was lost, i.e. it expired and the batch was given to another worker
+        """
+
+        cursor = self.connection.execute("UPDATE batches SET lease_expires = ? WHERE batch_id = ? AND "
+                                         "state = 'leased' AND worker = ?",
+                                         (time.time() + self.lease_seconds, batch_id, worker))
+        return cursor.rowcount == 1
+
+    def complete(self, batch_id, worker, results):
+        """
+        Store the green view index of the panoramas of the batch and mark it done. The results of a worker which
+        lost the lease are still stored, if the batch is not done yet
+
+        Parameters:
+            results: list of the (pano_id, green_view) of the batch
+        """
+
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            state = self.connection.execute('SELECT state FROM batches WHERE batch_id = ?',
+                                            (batch_id,)).fetchone()[0]
+            if state == 'done':
+                self.connection.execute('COMMIT')
+                return False
+
+            self.connection.executemany('UPDATE panoramas SET green_view = ? WHERE pano_id = ?',
+                                        [(float(green_view), pano_id) for pano_id, green_view in results])
+            self.connection.execute("UPDATE batches SET state = 'done', worker = ?, error = NULL WHERE batch_id = ?",
+                                    (worker, batch_id))
+            self.connection.execute('COMMIT')
+        except:
+            self.connection.execute('ROLLBACK')
+            raise
+
+        return True
+
+    def release(self, batch_id, worker, error):
+        """
+        Give the batch back to the queue after the worker failed, or mark it failed after max_attempts
+        """
+
+        self.connection.execute("UPDATE batches SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' "
+                                "END, worker = NULL, error = ? WHERE batch_id = ? AND state = 'leased' AND "
+                                "worker = ?", (self.max_attempts, str(error), batch_id, worker))
+
+    def progress(self):
+        """
+        Return the dictionary of the state and the number of the batches in the state, the expired leases are
+        given back to the queue first
+        """
+
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            self.requeue_expired()
+            self.connection.execute('COMMIT')
+        except:
+            self.connection.execute('ROLLBACK')
+            raise
+
+        return dict(self.connection.execute('SELECT state, COUNT(*) FROM batches GROUP BY state').fetchall())
+
+    def close(self):
+        self.connection.close()
+
+
+def run_worker(queue_db, key_file=None, worker=None, provider=None, key_pool=None, working_size=None,
+               result_cache=None, lease_seconds=600, max_attempts=3, wait=False, poll_interval=30):
+    """
+    Lease the batches from the queue and compute the green view index of their panoramas, until the queue is empty.
+    Start this in several processes on the machine of the queue file
+
+    Parameters:
+        queue_db: the SQLite file of the queue, see create_queue
+        key_file, provider, key_pool, working_size, result_cache: see
+        GreenView_Calculate.green_view_computing_ogr_6horizon
+        worker: the name of the worker, the default is the host name and the process id
+        lease_seconds, max_attempts: see WorkQueue
+        wait: keep waiting for new batches while other workers still have leased batches, which may be given back
+        poll_interval: the seconds between the checks for new batches when waiting
+    """
+
+    if __package__:
+        from . import KeyPool
+        from .GreenView_Calculate import check_result_cache, pano_green_view
+    else:
+        import KeyPool
+        from GreenView_Calculate import check_result_cache, pano_green_view
+
+    check_result_cache(result_cache, working_size)
+
+    if worker is None:
+        worker = '%s-%d' % (socket.gethostname(), os.getpid())
+    if provider is None:
+        if __package__:
+            from . import GSVProvider
+        else:
+            import GSVProvider
+        provider = GSVProvider.GoogleProvider()
+    if key_pool is None:
+        key_pool = KeyPool.KeyPool.from_file(key_file, min_interval=0.01)
+
+    heading_arr = 360 / 6 * numpy.array([0, 1, 2, 3, 4, 5])
+    num_gsv_img = len(heading_arr) * 1.0
+    pitch = 0
+
+    queue = WorkQueue(queue_db, lease_seconds, max_attempts)
+    num_batches = 0
+
+    while True:
+        leased = queue.lease(worker)
+        if leased is None:
+            if wait and queue.progress().get('leased', 0) > 0:
+                time.sleep(poll_interval)
+                continue
+            break
+
+        batch_id, panoramas = leased
+        print('Worker %s leased batch %d with %d panoramas' % (worker, batch_id, len(panoramas)))
+
+        try:
+            results = []
+            for pano_id, pano_date, lon, lat in panoramas:
+                try:
+                    green_view_val = pano_green_view(pano_id, heading_arr, pitch, provider, key_pool, working_size,
+                                                     result_cache)[0]
+                except KeyPool.KeysRejected:
+                    raise
+                # if the GSV images are not download successfully or failed to run, then return a null value
+                except Exception:
+                    print('SOMETHING UNEXPECTED JUST HAPPENED')
+                    green_view_val = -1000 / num_gsv_img
+
+                results.append((pano_id, green_view_val))
+                if not queue.renew(batch_id, worker):
+                    print('Worker %s lost the lease of batch %d' % (worker, batch_id))
+
+            if queue.complete(batch_id, worker, results):
+                num_batches += 1
+        except BaseException as error:
+            # the batch is given to another worker, e.g. when this worker is stopped
+            queue.release(batch_id, worker, repr(error))
+            queue.close()
+            key_pool.save()
+            raise
+
+    queue.close()
+    key_pool.save()
+    print('Worker %s completed %d batches' % (worker, num_batches))
+    return num_batches
+
+
+def write_results(queue_db, out_txt_root):
+    """
+    Write the green view index of the queue to the GV_ txt files of the metadata txt files, in the format of
+    GreenView_Calculate.green_view_computing_ogr_6horizon. The panoramas which were not computed are left out
+
+    Return:
+        the number of the written panoramas
+    """
+
+    if not os.path.exists(out_txt_root):
+        os.makedirs(out_txt_root)
+
+    connection = connect(queue_db)
+    rows = connection.execute('SELECT txt_file, pano_id, pano_date, lon, lat, green_view FROM panoramas '
+                              'WHERE green_view IS NOT NULL ORDER BY txt_file, seq').fetchall()
+    connection.close()
+
+    gv_res_txt = None
+    txt_file = None
+    for row in rows:
+        if row[0] != txt_file:
+            if gv_res_txt is not None:
+                gv_res_txt.close()
+            txt_file = row[0]
+            gv_res_txt = open(os.path.join(out_txt_root, 'GV_' + txt_file), 'w')
+
+        gv_res_txt.write('panoID: %s panoDate: %s longitude: %s latitude: %s, greenview: %s\n' % row[1:])
+
+    if gv_res_txt is not None:
+        gv_res_txt.close()
+
+    return len(rows)
+
+
+def run_coordinator(gsv_info_folder, queue_db, out_txt_root, greenmonth, batch_size=50, poll_interval=30):
+    """
+    Fill the queue with the panoramas of the metadata txt files, wait until the workers (see run_worker) have
+    processed all batches, and write the results to the GV_ txt files
+
+    Return:
+        the dictionary of the state and the number of the batches at the end, the failed batches can be given back
+        to the queue with requeue_failed
+    """
+
+    create_queue(queue_db, gsv_info_folder, greenmonth, batch_size)
+    queue = WorkQueue(queue_db)
+
+    while True:
+        progress = queue.progress()
+        print('Queue: %s' % ', '.join('%s %d' % item for item in sorted(progress.items())))
+        if progress.get('pending', 0) == 0 and progress.get('leased', 0) == 0:
+            break
+        time.sleep(poll_interval)
+
+    queue.close()
+    print('Wrote the green view index of %d panoramas' % write_results(queue_db, out_txt_root))
+    return progress
+
+
+def requeue_failed(queue_db):
+    """
+    Give the failed batches back to the queue, e.g. after new keys were added
+    """
+
+    connection = connect(queue_db)
+    cursor = connection.execute("UPDATE batches SET state = 'pending', attempts = 0 WHERE state = 'failed'")
+    connection.close()
+
+    return cursor.rowcount
+
+
+# ------------Main Function -------------------
+if __name__ == "__main__":
+    import sys
+
+    root = '..\\kastela'
+    queue_file = os.path.join(root, 'gvi_queue.sqlite')
+    greenmonth = ['05', '06', '07', '08', '09']
+
+    # python WorkQueue.py coordinator in one process, python WorkQueue.py worker in several processes
+    if len(sys.argv) > 1 and sys.argv[1] == 'worker':
+        run_worker(queue_file, 'keys.txt', wait=True)
+    else:
+        run_coordinator(os.path.join(root, 'metadata'), queue_file, os.path.join(root, 'GVI_values'), greenmonth)
@@ -1,4 +1,22 @@
-import Treepedia.metadataCollector 
-import Treepedia.Greenview2Shp
-import Treepedia.GreenViewCalc
-import Treepedia.createPoints
+# The submodules of Treepedia are loaded lazily, on the first access of Treepedia.<submodule>, so importing the
+# package (e.g. in every worker process) does not import gdal/ogr, fiona, skimage or matplotlib. The modules import
+# each other relatively inside the package and by their plain names when they are run as scripts from this folder.
+
+import importlib
+
+_submodules = ['Benchmark', 'ColorLUT', 'CorridorInteruption', 'GSVProvider', 'GVStats', 'GreenView_Calculate',
+               'Greenview2Shp', 'ImageQC', 'ImageRing', 'IncrementalRefresh', 'KeyPool', 'MemoryUsage', 'MultiCity',
+               'Panorama', 'ResultCache', 'Segmentor', 'Temporal', 'WorkQueue', 'createPoints', 'metadataCollector']
+
+__all__ = list(_submodules)
+
+
+def __getattr__(name):
+    if name not in _submodules:
+        raise AttributeError("module 'Treepedia' has no attribute '%s'" % name)
+
+    return importlib.import_module(__name__ + '.' + name)
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + _submodules)
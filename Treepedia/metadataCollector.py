@@ -3,7 +3,8 @@
 # Copyright(C) Xiaojiang Li, Ian Seiferling, Marwa Abdulhai, Senseable City Lab, MIT
 
 
-def gsv_pano_metadata_collector(samples_feature_class, num, output_text_folder):
+def gsv_pano_metadata_collector(samples_feature_class, num, output_text_folder, provider=None, key_file=None,
+                                key_pool=None, report_memory=False, retries=3):
     """
     This function is used to call the Google API url to collect the metadata of
     Google Street View Panoramas. The input of the function is the shpfile of the create sample site, the output
@@ -13,94 +14,177 @@ def gsv_pano_metadata_collector(samples_feature_class, num, output_text_folder):
         samples_feature_class: the shapefile of the create sample sites
         num: the number of sites processed every time
         output_text_folder: the output folder for the panoinfo
+        provider: the provider of the GSV metadata (see GSVProvider), the default is GSVProvider.GoogleProvider(),
+        use GSVProvider.ReplayProvider to run without network
+        key_file: the API keys in txt file, each key is one row, the metadata requests are made without key if
+        neither key_file nor key_pool is given
+        key_pool: the KeyPool spreading the requests over the keys, the default is a pool of the keys in key_file
+        report_memory: report the peak memory of the stage (see MemoryUsage)
+        retries: the number of the requests again of the metadata which failed with a server error (5xx), a batch
+        with a point still failing is not saved, so it is collected again by the next run. The points with another
+        error status are skipped like the points without panorama
     """
 
-    from urllib import request
     import xmltodict
     import ogr
-    import osr
+    import numpy
     import time
     import os.path
     import math
+    from pyproj import CRS, Transformer
+    if __package__:
+        from . import GSVProvider
+        from . import KeyPool
+        from .MemoryUsage import memory_stage
+    else:
+        import GSVProvider
+        import KeyPool
+        from MemoryUsage import memory_stage
+
+    if provider is None:
+        provider = GSVProvider.GoogleProvider()
+
+    if key_pool is None and key_file is not None:
+        key_pool = KeyPool.KeyPool.from_file(key_file, min_interval=0.05)
 
     if not os.path.exists(output_text_folder):
         os.makedirs(output_text_folder)
 
     driver = ogr.GetDriverByName('ESRI Shapefile')
 
-    # change the projection of shapefile to the WGS84
     dataset = driver.Open(samples_feature_class)
     layer = dataset.GetLayer()
 
-    source_proj = layer.GetSpatialRef()
-    target_proj = osr.SpatialReference()
-    target_proj.ImportFromEPSG(4326)
-    transform = osr.CoordinateTransformation(source_proj, target_proj)
+    # change the projection of shapefile to the WGS84, the coordinates of a batch are transformed together, always_xy
+    # keeps the longitude, latitude order
+    source_proj = CRS.from_wkt(layer.GetSpatialRef().ExportToWkt())
+    transformer = Transformer.from_crs(source_proj, CRS.from_epsg(4326), always_xy=True)
 
     # loop all the features in the featureclass
-    # feature = layer.GetNextFeature()
     feature_num = layer.GetFeatureCount()
     batch = int(math.ceil(feature_num / num))
     print(batch)
 
-    for b in range(batch):
-        # for each batch process num GSV site
-        start = b * num
-        end = (b + 1) * num
-        if end > feature_num:
-            end = feature_num
-
-        output_text_file = 'Pnt_start%s_end%s.txt' % (start, end)
-        output_gsv_info_file = os.path.join(output_text_folder, output_text_file)
-
-        # skip over those existing txt files
-        if os.path.exists(output_gsv_info_file):
-            continue
-
-        time.sleep(1)
-
-        with open(output_gsv_info_file, 'w') as panoInfoText:
-            # process num feature each time
-            for i in range(start, end):
-                feature = layer.GetFeature(i)
-                geom = feature.GetGeometryRef()
-
-                # transform the current projection of input shapefile to WGS84
-                # WGS84 is Earth centered, earth fixed terrestrial ref system
-                geom.Transform(transform)
-                # TODO check what is happening with axis order
-                lon = geom.GetY()
-                lat = geom.GetX()
-
-                # get the meta data of panoramas
-                url_address = 'http://maps.google.com/cbk?output=xml&ll=%s,%s' % (lat, lon)
-
-                time.sleep(0.05)
-                # the output result of the meta data is a xml object
-                meta_dataxml = request.urlopen(url_address)
-                meta_data = meta_dataxml.read()
-
-                data = xmltodict.parse(meta_data)
-
-                # in case there is not panorama in the site, therefore, continue
-                if data['panorama'] is None:
-                    continue
-                else:
-                    pano_info = data['panorama']['data_properties']
-
-                    # get the meta data of the panorama
-                    pano_date = list(pano_info.items())[4][1]
-                    pano_id = list(pano_info.items())[5][1]
-                    pano_lat = list(pano_info.items())[8][1]
-                    pano_lon = list(pano_info.items())[9][1]
-
-                    print('The coordinate (%s,%s), panoId is: %s, panoDate is: %s' % (pano_lon, pano_lat, pano_id,
-                                                                                      pano_date))
-                    line_txt = 'panoID: %s panoDate: %s longitude: %s latitude: %s\n' % (pano_id, pano_date, pano_lon,
-                                                                                         pano_lat)
-                    panoInfoText.write(line_txt)
-
-        panoInfoText.close()
+    with memory_stage('metadata collection', report_memory):
+        for b in range(batch):
+            # for each batch process num GSV site
+            start = b * num
+            end = (b + 1) * num
+            if end > feature_num:
+                end = feature_num
+
+            output_text_file = 'Pnt_start%s_end%s.txt' % (start, end)
+            output_gsv_info_file = os.path.join(output_text_folder, output_text_file)
+
+            # skip over those existing txt files
+            if os.path.exists(output_gsv_info_file):
+                continue
+
+            time.sleep(1)
+
+            # read the features of the batch sequentially, instead of accessing each feature by its index
+            layer.SetNextByIndex(start)
+            xs = numpy.empty(end - start)
+            ys = numpy.empty(end - start)
+            for j in range(end - start):
+                geom = layer.GetNextFeature().GetGeometryRef()
+                xs[j] = geom.GetX()
+                ys[j] = geom.GetY()
+
+            lons, lats = transformer.transform(xs, ys)
+            del xs, ys
+
+            # write to a temporary file first, the txt file only exists when the batch is complete
+            num_failed = 0
+            temp_file = '%s.%d.tmp' % (output_gsv_info_file, os.getpid())
+            # the partial temporary file is removed when the batch fails with an exception
+            try:
+                with open(temp_file, 'w') as panoInfoText:
+                    # process num feature each time
+                    for i in range(start, end):
+                        lon = float(lons[i - start])
+                        lat = float(lats[i - start])
+
+                        # get the meta data of panoramas, the output result of the meta data is a xml object. The
+                        # metadata requests are not counted to the image quota of the keys
+                        for attempt in range(retries + 1):
+                            if key_pool is None:
+                                time.sleep(0.05)
+                                response = provider.get_metadata(lat, lon)
+                            else:
+                                response = key_pool.request(lambda key: provider.get_metadata(lat, lon, key=key),
+                                                            cost=0)
+
+                            if response.status < 500:
+                                break
+                            time.sleep(2 ** attempt)
+
+                        if response.status != 200:
+                            print('The metadata of the point %d failed with the status %d' % (i, response.status))
+                            if response.status >= 500:
+                                num_failed += 1
+                            continue
+
+                        data = xmltodict.parse(response.content)
+
+                        # in case there is not panorama in the site, therefore, continue
+                        if data['panorama'] is None:
+                            continue
+                        else:
+                            pano_info = data['panorama']['data_properties']
+
+                            # get the meta data of the panorama
+                            pano_date = list(pano_info.items())[4][1]
+                            pano_id = list(pano_info.items())[5][1]
+                            pano_lat = list(pano_info.items())[8][1]
+                            pano_lon = list(pano_info.items())[9][1]
+
+                            # the full size of the panorama and the compass heading of its middle column, to cut the
+                            # views from the panorama tiles (see Panorama)
+                            image_width = pano_info.get('@image_width', 0)
+                            image_height = pano_info.get('@image_height', 0)
+                            projection = data['panorama'].get('projection_properties') or {}
+                            pano_yaw = projection.get('@pano_yaw_deg', 0)
+
+                            print('The coordinate (%s,%s), panoId is: %s, panoDate is: %s' % (pano_lon, pano_lat,
+                                                                                              pano_id, pano_date))
+                            # the index of the sample point is the key to compare the metadata of different runs
+                            line_txt = 'panoID: %s panoDate: %s longitude: %s latitude: %s pointID: %d ' \
+                                       'imageWidth: %s imageHeight: %s panoYaw: %s\n' % (
+                                           pano_id, pano_date, pano_lon, pano_lat, i, image_width, image_height,
+                                           pano_yaw)
+                            panoInfoText.write(line_txt)
+            except BaseException:
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+                raise
+
+            if num_failed > 0:
+                print('%d points of %s failed, the batch is collected again by the next run' % (num_failed,
+                                                                                           output_text_file))
+                os.remove(temp_file)
+            else:
+                os.replace(temp_file, output_gsv_info_file)
+
+    if key_pool is not None:
+        key_pool.save()
+
+
+def parse_metadata_line(line):
+    """
+    Parse a line of the metadata txt files written by gsv_pano_metadata_collector
+
+    Parameters:
+        line: the line 'panoID: ... panoDate: ... longitude: ... latitude: ... pointID: ... imageWidth: ...
+            imageHeight: ... panoYaw: ...', the metadata of older runs end after latitude or pointID
+
+    Return:
+        the dict of the field name, e.g. 'panoID' or 'pointID', to the value string of the field
+    """
+
+    fields = line.split()
+
+    return dict((name.rstrip(':'), value) for name, value in zip(fields[0::2], fields[1::2]))
 
 
 # ------------Main Function -------------------
@@ -0,0 +1,120 @@
+import json
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Treepedia import GSVProvider, KeyPool  # noqa: E402
+
+QUOTA_MESSAGE = b'You have exceeded your daily request quota for this API.'
+INVALID_MESSAGE = b'The provided API key is invalid.'
+
+
+class FakeFetch:
+    """
+    Answer the requests with the response of the key, the keys without a response get 200
+    """
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.keys = []
+
+    def __call__(self, key):
+        self.keys.append(key)
+        status, content = self.responses.get(key, (200, b'image'))
+        return GSVProvider.ProviderResponse(status, content)
+
+
+def test_quota_response_blocks_key_until_reset(monkeypatch):
+    pool = KeyPool.KeyPool(['a', 'b'], daily_quota=100)
+    fetch = FakeFetch({'a': (403, QUOTA_MESSAGE)})
+
+    response = pool.request(fetch)
+
+    assert response.status == 200
+    assert fetch.keys == ['a', 'b']
+    assert 'a' not in pool.rejected
+    assert pool.usage['a'] == 100
+    assert pool.remaining() == 99
+    assert [pool.acquire() for _ in range(3)] == ['b', 'b', 'b']
+
+    # the quota of the key is reset on the next day
+    day = pool.day
+    monkeypatch.setattr(pool, '_today', lambda: day + 1)
+    assert pool.remaining() == 200
+    assert pool.acquire() == 'a'
+
+
+def test_rejected_key_is_dropped():
+    pool = KeyPool.KeyPool(['a', 'b'], daily_quota=100)
+    fetch = FakeFetch({'a': (403, INVALID_MESSAGE)})
+
+    response = pool.request(fetch)
+
+    assert response.status == 200
+    assert fetch.keys == ['a', 'b']
+    assert pool.rejected == {'a'}
+    # the key is dropped, not used up, the other keys take all requests
+    assert pool.usage['a'] == 1
+    assert [pool.acquire() for _ in range(3)] == ['b', 'b', 'b']
+
+
+def test_keys_rejected_when_no_key_is_left():
+    pool = KeyPool.KeyPool(['a', 'b'])
+    fetch = FakeFetch({'a': (403, INVALID_MESSAGE), 'b': (403, INVALID_MESSAGE)})
+
+    with pytest.raises(KeyPool.KeysRejected):
+        pool.request(fetch)
+
+    assert fetch.keys == ['a', 'b']
+    with pytest.raises(KeyPool.KeysRejected):
+        pool.acquire()
+
+
+def test_rate_limit_backoff():
+    pool = KeyPool.KeyPool(['a', 'b'], backoff=10, max_backoff=30)
+
+    # the waiting time doubles for every 429 response, up to max_backoff
+    for wait in [10, 20, 30, 30]:
+        before = time.time()
+        pool.report('a', 429)
+        assert before + wait <= pool.blocked_until['a'] <= time.time() + wait
+
+    # the other key takes the requests while the key is backing off
+    fetch = FakeFetch({})
+    assert pool.request(fetch).status == 200
+    assert fetch.keys == ['b']
+
+    # a successful response resets the backoff
+    pool.report('a', 200)
+    pool.blocked_until['a'] = 0.0
+    before = time.time()
+    pool.report('a', 429)
+    assert before + 10 <= pool.blocked_until['a'] <= time.time() + 10
+
+
+def test_save_merges_usage_of_several_pools(tmp_path):
+    usage_file = str(tmp_path / 'keys.txt.usage.json')
+    first = KeyPool.KeyPool(['a', 'b'], usage_file)
+    second = KeyPool.KeyPool(['a', 'b'], usage_file)
+
+    assert first.acquire(cost=5) == 'a'
+    assert second.acquire(cost=7) == 'a'
+    first.save()
+    second.save()
+
+    # only the requests since the last save are added, the saves of both pools are kept
+    with open(usage_file, 'r') as usage_json:
+        assert json.load(usage_json)['usage'] == {'a': 12, 'b': 0}
+    assert second.usage['a'] == 12
+
+    first.save()
+    assert first.usage['a'] == 12
+    with open(usage_file, 'r') as usage_json:
+        assert json.load(usage_json)['usage'] == {'a': 12, 'b': 0}
+
+    # a new pool starts from the merged usage
+    assert KeyPool.KeyPool(['a', 'b'], usage_file).usage == {'a': 12, 'b': 0}
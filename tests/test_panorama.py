@@ -0,0 +1,103 @@
+import os
+import sys
+from io import BytesIO
+
+import numpy
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Treepedia import GSVProvider, KeyPool, Panorama  # noqa: E402
+
+HEADINGS = [0, 60, 120, 180, 240, 300]
+
+# one colour for the sector of +-30 degree around each heading
+COLOURS = numpy.array([[255, 0, 0], [0, 255, 0], [0, 0, 255], [255, 255, 0], [0, 255, 255], [255, 0, 255]],
+                      dtype=numpy.uint8)
+
+
+def synthetic_panorama(width, height, pano_yaw=0):
+    """
+    The equirectangular panorama with the colour of the sector of the compass heading of every column
+    """
+
+    relative = (numpy.arange(width) + 0.5) / width * 360.0 - 180.0
+    sector = numpy.round((relative + pano_yaw) / 60.0).astype(int) % 6
+
+    return numpy.repeat(COLOURS[sector][None, :, :], height, axis=0)
+
+
+def view_centres(views, margin=50):
+    return views[:, margin:-margin, margin:-margin]
+
+
+class TileProvider:
+    """
+    Serve the tiles of the panorama padded with black to the grid of the tiles, like the cbk service
+    """
+
+    def __init__(self, pano, zoom, tile_size=512):
+        self.tile_size = tile_size
+        self.grid = numpy.zeros((tile_size * max(2 ** (zoom - 1), 1), tile_size * 2 ** zoom, 3), dtype=numpy.uint8)
+        self.grid[:pano.shape[0], :pano.shape[1]] = pano
+        self.requests = 0
+
+    def get_tile(self, pano_id, zoom, x, y, key=None):
+        self.requests += 1
+        tile = self.grid[y * self.tile_size:(y + 1) * self.tile_size, x * self.tile_size:(x + 1) * self.tile_size]
+        content = BytesIO()
+        Image.fromarray(tile).save(content, format='PNG')
+        return GSVProvider.ProviderResponse(200, content.getvalue())
+
+
+def test_panorama_size():
+    assert Panorama.panorama_size(13312, 6656, 2) == (1664, 832)
+    assert Panorama.panorama_size(16384, 8192, 2) == (2048, 1024)
+    assert Panorama.panorama_size(16384, 8192, 3) == (4096, 2048)
+
+
+def test_cut_views_at_compass_headings():
+    table = Panorama.build_view_table(1664, 832, HEADINGS, view_size=200)
+
+    for pano_yaw in [0, 45, 200]:
+        views = Panorama.cut_views(synthetic_panorama(1664, 832, pano_yaw), table, pano_yaw)
+
+        assert views.shape == (6, 200, 200, 3)
+        for idx, centre in enumerate(view_centres(views)):
+            assert (centre == COLOURS[idx]).all(), (pano_yaw, HEADINGS[idx])
+
+
+def test_cut_views_with_pitch():
+    table = Panorama.build_view_table(1664, 832, HEADINGS, pitch=20, view_size=200)
+    rows = table[0]
+
+    # the views look up, the middle row of the views is above the horizon
+    assert rows[:, 100, 100].max() < 832 // 2
+    views = Panorama.cut_views(synthetic_panorama(1664, 832, 90), table, 90)
+    for idx, centre in enumerate(view_centres(views)):
+        assert (centre == COLOURS[idx]).all()
+
+
+def test_fetch_panorama_crops_to_image_size():
+    pano = synthetic_panorama(1664, 832, 30)
+    provider = TileProvider(pano, 2)
+    pano_size = Panorama.panorama_size(13312, 6656, 2)
+
+    fetched = Panorama.fetch_panorama('A' * 22, provider, KeyPool.KeyPool(['k']), 2, pano_size=pano_size)
+
+    assert fetched.shape == (832, 1664, 3)
+    assert (fetched == pano).all()
+
+
+def test_views_of_cropped_panorama():
+    # without the crop the black padding of the tiles would shift and stretch the views
+    pano = synthetic_panorama(1664, 832, 30)
+    provider = TileProvider(pano, 2)
+    table = Panorama.build_view_table(1664, 832, HEADINGS, view_size=200)
+
+    fetched = Panorama.fetch_panorama('A' * 22, provider, KeyPool.KeyPool(['k']), 2,
+                                      tile_rows=Panorama.tile_rows_needed(table), pano_size=(1664, 832))
+    views = Panorama.cut_views(fetched, table, 30)
+
+    for idx, centre in enumerate(view_centres(views)):
+        assert (centre == COLOURS[idx]).all()